@@ -0,0 +1,107 @@
+"""
+LogFrameParser throughput benchmark.
+Builds docker logs streams (multiplexed frames and tty), feeds them in random sized
+chunks, checks parsed records against generated ones and prints lines/s.
+
+    python bench/log_parser_bench.py [--lines 200000] [--seed 1]
+"""
+import argparse
+import importlib.util
+import random
+from pathlib import Path
+from time import perf_counter
+
+# loaded by path, director package imports band on init
+PARSER_PATH = Path(__file__).resolve().parent.parent / 'director' / 'log_parser.py'
+spec = importlib.util.spec_from_file_location('log_parser', PARSER_PATH)
+log_parser = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(log_parser)
+
+WORDS = ('request', 'handled', 'user', 'запрос', 'обработан', 'status=200', 'ms', '{"k": 1}')
+
+
+def make_line(rnd):
+    return ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 30)))
+
+
+def make_payloads(rnd, lines):
+    """
+    (source, [lines]) items, some payloads hold several lines
+    """
+    payloads = []
+    left = lines
+    while left:
+        count = min(left, 1 if rnd.random() < 0.8 else rnd.randint(2, 10))
+        source = 'stderr' if rnd.random() < 0.2 else 'stdout'
+        payloads.append((source, [make_line(rnd) for _ in range(count)]))
+        left -= count
+    return payloads
+
+
+def frames_stream(payloads):
+    stream = bytearray()
+    for source, lines in payloads:
+        data = ('\n'.join(lines) + '\n').encode()
+        stream += log_parser.HEADER.pack(log_parser.STREAMS.index(source), len(data))
+        stream += data
+    return bytes(stream)
+
+
+def tty_stream(payloads):
+    return ''.join(line + '\n' for _, lines in payloads for line in lines).encode()
+
+
+def expected(payloads, tty):
+    """
+    (source, size, message) records, size is line bytes with newline
+    """
+    return [('stdout' if tty else source, len(line.encode()) + 1, line)
+            for source, lines in payloads for line in lines]
+
+
+def chunked(rnd, stream, max_chunk):
+    """
+    Random sized chunks: small ones split headers and payloads,
+    large ones coalesce many frames
+    """
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rnd.randint(1, 16) if rnd.random() < 0.3 else rnd.randint(1, max_chunk)
+        chunks.append(stream[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def run(name, chunks, want):
+    parser = log_parser.LogFrameParser()
+    got = []
+    start = perf_counter()
+    for chunk in chunks:
+        got.extend(parser.feed(chunk))
+    elapsed = perf_counter() - start
+    assert len(got) == len(want), f'{name}: {len(got)} records, {len(want)} expected'
+    for i, (item, want_item) in enumerate(zip(got, want)):
+        assert item == want_item, f'{name}: record {i} {item} != {want_item}'
+    assert not parser.buf, f'{name}: {len(parser.buf)} bytes left unparsed'
+    size = sum(map(len, chunks))
+    print(f'{name:8} {len(got):>9} lines {len(chunks):>8} chunks '
+          f'{len(got) / elapsed:>12,.0f} lines/s {size / elapsed / 2 ** 20:>8.1f} MB/s')
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    ap.add_argument('--lines', type=int, default=200000)
+    ap.add_argument('--max-chunk', type=int, default=32768)
+    ap.add_argument('--seed', type=int, default=1)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    payloads = make_payloads(rnd, args.lines)
+    for name, stream, tty in (('frames', frames_stream(payloads), False),
+                              ('tty', tty_stream(payloads), True)):
+        run(name, chunked(rnd, stream, args.max_chunk), expected(payloads, tty))
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ from band.constants import (NOTIFY_ALIVE, REQUEST_STATUS, OK, FRONTIER_SERVICE,
 from band.lib.response import BaseBandResponse
 from ..constants import (STATUS_RUNNING, STARTED_SET, SHARED_CONFIG_KEY)
 from ..structs import RunParams, BuildOptions, ServicePostion
-from ..helpers import merge, req_to_bool
+from ..helpers import merge, req_to_bool, req_to_int
 from .. import dock, state, image_navigator
 """
 Request helpers
@@ -21,6 +21,7 @@ def build_options_from_req(params: Dict):
     return BuildOptions(
         nocache=req_to_bool(params.get('nocache', None)),
         auto_remove=req_to_bool(params.get('auto_remove', None)),
+        blue_green=req_to_bool(params.get('blue_green', None)),
         env=pdict.from_dict(params.get('env', {})))
 
 
@@ -70,12 +71,66 @@ async def registrations(**params):
     return state.registrations()
 
 
+@expose()
+async def logs_subscribers(**params):
+    """
+    Log subscribers queues, drop counters and shipping stats
+    Method for debug purposes
+    """
+    return dict(subscribers=dock.logs.stats(), shipper=dock.log_shipper.stats())
+
+
+@expose()
+async def ports(**params):
+    """
+    Host ports allocations
+    Method for debug purposes
+    """
+    return dock.ports.stats()
+
+
+@expose()
+async def operations(**params):
+    """
+    Running and queued services operations
+    Method for debug purposes
+    """
+    return state.ops.stats()
+
+
+@expose()
+async def health(**params):
+    """
+    Services status requests latency and failures
+    Method for debug purposes
+    """
+    return state.health.stats()
+
+
+@expose(path='/logs/{name}')
+async def logs(name, last=None, since_id=None, until_id=None, **params):
+    """
+    Service logs history
+    last - number of newest records
+    since_id, until_id - flake ids range, since_id exclusive
+    """
+    ring = dock.log_history.get(name)
+    if not ring:
+        return []
+    records = ring.records(since_id=req_to_int(since_id),
+                           until_id=req_to_int(until_id),
+                           last=req_to_int(last))
+    return [rec._asdict() for rec in records]
+
+
 @expose(name=NOTIFY_ALIVE)
 async def status_receiver(name, **params):
     """
     Listen for services promotions then ask their statuses.
     It some cases takes payload to reduce calls amount
     """
+    if name == FRONTIER_SERVICE:
+        state.reset_frontier_regs()
     await state.request_app_state(name)
 
 
@@ -126,6 +181,7 @@ async def run(name, **req_params):
     pos - string contains prefered coordinates, for example "2x3" (col x row)
     nocache - Set docker build option. By default nocache=false. 
     auto_remove - Set docker build option.
+    blue_green - Start new container next to running one and swap them when it's ready.
     env - 
     """
 
@@ -163,11 +219,46 @@ async def set_pos(name, **params):
 @expose()
 async def rebuild_all(**kwargs):
     """
-    Rebuild all controlled containers
+    Rebuild all controlled containers.
+    Returns build job id, progress available at /build_job/{job_id}
+    """
+    names = [name for name in await state.should_start()
+             if image_navigator.is_native(name)]
+    job = await state.build_services(sorted(names))
+    return dict(job_id=job.id)
+
+
+@expose(path='/build_job/{job_id}')
+async def build_job(job_id, **params):
+    """
+    Build job progress
+    """
+    try:
+        job = state.builds.get(req_to_int(job_id))
+    except ValueError:
+        return 404
+    if not job:
+        return 404
+    return job.progress()
+
+
+@expose(path='/build_progress/{name}')
+async def build_progress(name, **params):
+    """
+    Last image build progress of service
+    """
+    progress = dock.build_progress.get(name)
+    if not progress:
+        return 404
+    return progress.as_dict()
+
+
+@expose()
+async def deploy_timings(**params):
+    """
+    Last redeploy phases durations (build, remove, create, start), ms
     """
-    for name in await state.should_start():
-        await run(name)
-    return 200
+    return dock.deploy_timings
 
 
 @expose(path='/restart/{name}')
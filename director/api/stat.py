@@ -1,42 +1,159 @@
 import asyncio
 import ujson
 import re
+from collections import OrderedDict
+from time import time
 from band import expose, logger, settings
 from simplech import AsyncClickHouse
 from async_timeout import timeout
 from .. import stat_queries
+from ..stat_cache import StatCache
+from ..stat_rollup import EventsRollup
+from ..constants import (
+    STAT_TTL, STAT_MAX_STALE, STAT_WAIT, STAT_QUERY_TIMEOUT, STAT_KEYS_KEEP, STAT_WINDOW,
+    STAT_MIN_RANGE, STAT_MAX_RANGE, STAT_STEPS, STAT_MAX_POINTS, STAT_SAMPLE_RANGE)
 
 ch = AsyncClickHouse()
+cache = StatCache(
+    ttl=settings.get('stat_ttl', STAT_TTL),
+    max_stale=settings.get('stat_max_stale', STAT_MAX_STALE),
+    wait=settings.get('stat_wait', STAT_WAIT))
+# events_stat series by (range, step), updated incrementally
+rollups = OrderedDict()
+
+RANGE_UNITS = dict(s=1, m=60, h=3600, d=86400)
+
+
+def to_seconds(val):
+    """
+    Seconds from number or string like "15m", "24h", "7d"
+    """
+    val = str(val).strip().lower()
+    unit = RANGE_UNITS.get(val[-1:])
+    try:
+        return int(val[:-1]) * unit if unit else int(val)
+    except ValueError:
+        raise ValueError(f'bad duration {val}')
+
+
+def parse_range(val, default=STAT_WINDOW):
+    if val is None or val == '':
+        return default
+    seconds = to_seconds(val)
+    if not STAT_MIN_RANGE <= seconds <= STAT_MAX_RANGE:
+        raise ValueError(f'range should be between {STAT_MIN_RANGE} and {STAT_MAX_RANGE} seconds')
+    return seconds
+
+
+def pick_step(range_, step=None):
+    """
+    Requested step or smallest standard one fitting STAT_MAX_POINTS buckets
+    """
+    if step:
+        step = to_seconds(step)
+        if step <= 0 or range_ / step > STAT_MAX_POINTS:
+            raise ValueError(f'step gives more than {STAT_MAX_POINTS} points')
+        return step
+    for s in STAT_STEPS:
+        if range_ / s <= STAT_MAX_POINTS:
+            return s
+    return STAT_STEPS[-1]
+
+
+def pick_sample(range_):
+    """
+    Sampling ratio for wide ranges. Requires events table SAMPLE BY, so off unless configured
+    """
+    sample = settings.get('stat_sample')
+    if sample and range_ >= settings.get('stat_sample_range', STAT_SAMPLE_RANGE):
+        return float(sample)
+
+
+def get_rollup(range_, step, sample):
+    key = (range_, step, sample)
+    rollup = rollups.get(key)
+    if not rollup:
+        rollup = rollups[key] = EventsRollup(step=step, window=range_, sample=sample)
+        while len(rollups) > STAT_KEYS_KEEP:
+            rollups.popitem(last=False)
+    rollups.move_to_end(key)
+    return rollup
+
+
+class StatQueryError(Exception):
+    pass
+
+
+async def select_data(query, handler=None):
+    """
+    Query rows streamed in JSONEachRow format and decoded one by one.
+    Rows passed to handler as they arrive, collected to list without it.
+    Raises StatQueryError on ClickHouse error reply, simplech only logs it
+    """
+    rows = []
+    consume = handler or rows.append
+    async with timeout(settings.get('stat_query_timeout', STAT_QUERY_TIMEOUT)):
+        async with ch.conn_class() as session:
+            async with ch._make_request(query + stat_queries.FMT_JSON_ROW, session) as response:
+                if response.status != 200:
+                    text = await response.text()
+                    raise StatQueryError(f'ClickHouse HTTP {response.status}: {text[:500]}')
+                async for line in response.content:
+                    if line.strip():
+                        consume(ujson.loads(line))
+    return rows
+
+
+async def load_groups(range_, sample):
+    where = stat_queries.events_where(since=int(time()) - range_)
+    rows = await select_data(stat_queries.groups(where, sample=sample))
+    return stat_queries.groups_data(rows)
+
 
 @expose()
-async def common_stat(**params):
-    where = stat_queries.events_where()
-    query = stat_queries.groups(where) + stat_queries.FMT_JSON
+async def common_stat(range=None, **params):
+    """
+    Sessions users by source, new/returning and device.
+    params:
+    range - seconds or "24h", "7d" like string, 24h by default
+    """
     try:
-        async with timeout(1):
-            stat_groups = await ch.select(query)
-            if stat_groups:
-                return ujson.loads(stat_groups)['data']
-    except asyncio.TimeoutError:
-        logger.error('stat get error')
-    except asyncio.CancelledError:
-        pass
-    return []
+        range_ = parse_range(range)
+    except ValueError as exc:
+        return dict(error=str(exc))
+    sample = pick_sample(range_)
+    return await cache.get(
+        ('common_stat', range_, sample), lambda: load_groups(range_, sample), default=[])
 
 
 @expose()
-async def events_stat(**params):
-    events_where = stat_queries.events_where()
-    query = stat_queries.events(events_where) + stat_queries.FMT_JSON
+async def events_stat(range=None, step=None, **params):
+    """
+    Events counts by name in time buckets.
+    params:
+    range - seconds or "24h", "7d" like string, 24h by default
+    step - bucket size, picked by range when omitted
+    """
     try:
-        async with timeout(1):
-            stat_events = await ch.select(query)
-            return ujson.loads(stat_events)['data'] if stat_events else []
-    except asyncio.TimeoutError:
-        logger.exception('stat get error')
-    except asyncio.CancelledError:
-        pass
-    return []
+        range_ = parse_range(range)
+        step = pick_step(range_, step)
+    except ValueError as exc:
+        return dict(error=str(exc))
+    sample = pick_sample(range_)
+    rollup = get_rollup(range_, step, sample)
+    return await cache.get(
+        ('events_stat', range_, step, sample),
+        lambda: rollup.refresh(select_data, stat_queries), default=[])
+
+
+@expose()
+async def stat_cache(**params):
+    """
+    Stats cache entries age
+    Method for debug purposes
+    """
+    return cache.stats()
+
 
 def clean_query(query):
     return re.sub(r"\s+", " ", query.replace('\n', ' '), flags=re.UNICODE)
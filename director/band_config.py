@@ -1,3 +1,4 @@
+import asyncio
 import ujson
 import yaml
 import time
@@ -6,8 +7,11 @@ import aioredis
 from prodict import Prodict
 from band import app, settings, redis_factory, logger
 
+from .constants import REDIS_POOL_SIZE, REDIS_TIMEOUT
+
 SERVICE_PREFIX = 'band-config-'
 SET_PREFIX = 'band-set-'
+HASH_PREFIX = 'band-hash-'
 
 
 def pconf(name):
@@ -23,17 +27,34 @@ def pset(name):
     return f'{SET_PREFIX}{name}'
 
 
+def phash(name):
+    return f'{HASH_PREFIX}{name}'
+
+
 def decode(name):
     return name.decode()
 
 
 class BandConfig:
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, redis_dsn=None, redis_pool_size=None, redis_timeout=None,
+                 **kwargs):
         self.redis_pool = None
+        self.redis_dsn = redis_dsn
+        # own pool created when dsn known, shared band pool otherwise
+        self.pool_size = redis_pool_size or REDIS_POOL_SIZE
+        # command reply timeout, seconds
+        self.timeout = redis_timeout or REDIS_TIMEOUT
+        self._own_pool = False
 
     async def initialize(self):
         logger.info("Initializing BandConfig")
-        self.redis_pool = await redis_factory.create_pool()
+        if self.redis_dsn:
+            self.redis_pool = await aioredis.create_pool(
+                self.redis_dsn, minsize=1, maxsize=self.pool_size,
+                create_connection_timeout=self.timeout)
+            self._own_pool = True
+        else:
+            self.redis_pool = await redis_factory.create_pool()
         logger.debug('Band state configs holder started')
 
     def encode(self, **data):
@@ -45,7 +66,16 @@ class BandConfig:
 
     async def __redis_cmd(self, cmd, *args):
         with await self.redis_pool as conn:
-            return await conn.execute(cmd, *args)
+            return await asyncio.wait_for(conn.execute(cmd, *args), self.timeout)
+
+    async def __redis_batch(self, *cmds):
+        """
+        Commands written to single connection at once, replies read together.
+        One round trip for all of them
+        """
+        with await self.redis_pool as conn:
+            return await asyncio.wait_for(
+                asyncio.gather(*(conn.execute(*cmd) for cmd in cmds)), self.timeout)
 
     async def set_exists(self, key):
         return await self.__redis_cmd('exists', pset(key))
@@ -59,6 +89,20 @@ class BandConfig:
     async def set_get(self, key):
         return set(map(decode, await self.__redis_cmd('smembers', pset(key))))
 
+    async def hash_set(self, key, field, value):
+        await self.__redis_cmd('hset', phash(key), field, self.encode(**value))
+
+    async def hash_rm(self, key, *fields):
+        await self.__redis_cmd('hdel', phash(key), *fields)
+
+    async def hash_get(self, key):
+        raw = await self.__redis_cmd('hgetall', phash(key))
+        if isinstance(raw, dict):
+            raw = raw.items()
+        else:
+            raw = zip(raw[::2], raw[1::2])
+        return {decode(k): self.decode(v) for k, v in raw}
+
     async def configs_list(self):
         return list(
             map(upconf,
@@ -66,15 +110,44 @@ class BandConfig:
                                                    f'{SERVICE_PREFIX}*'))))
 
     async def save_config(self, name, params):
-        raw = self.encode(**params)
-        with await self.redis_pool as conn:
-            await conn.execute('set', pconf(name), raw)
+        await self.__redis_cmd('set', pconf(name), self.encode(**params))
 
-    async def load_config(self, name):
-        with await self.redis_pool as conn:
-            raw = await conn.execute('get', pconf(name))
-            data = self.decode(raw)
+    def config_struct(self, raw):
+        data = self.decode(raw)
         return Prodict.from_dict(data) if isinstance(data, dict) else data
 
+    async def load_config(self, name):
+        return self.config_struct(await self.__redis_cmd('get', pconf(name)))
+
+    async def load_configs(self, names):
+        """
+        Configs of services with single MGET, name -> config or None
+        """
+        names = list(names)
+        if not names:
+            return dict()
+        raws = await self.__redis_cmd('mget', *map(pconf, names))
+        return {name: self.config_struct(raw) for name, raw in zip(names, raws)}
+
+    async def load_all(self, *sets):
+        """
+        All services configs and given sets contents.
+        Keys listing and sets are pipelined, configs fetched by MGET: two round trips
+        """
+        replies = await self.__redis_batch(
+            ('keys', f'{SERVICE_PREFIX}*'),
+            *(('smembers', pset(key)) for key in sets),
+            *(('exists', pset(key)) for key in sets))
+        keys, members, exists = replies[0], replies[1:len(sets) + 1], replies[len(sets) + 1:]
+        names = [upconf(decode(k)) for k in keys]
+        return Prodict(
+            configs=await self.load_configs(names),
+            sets={key: set(map(decode, m)) for key, m in zip(sets, members)},
+            exists={key: bool(e) for key, e in zip(sets, exists)})
+
     async def unload(self):
-        await redis_factory.close_pool(self.redis_pool)
+        if self._own_pool:
+            self.redis_pool.close()
+            await self.redis_pool.wait_closed()
+        else:
+            await redis_factory.close_pool(self.redis_pool)
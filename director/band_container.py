@@ -111,7 +111,10 @@ class BandContainer():
         if self.d.Ports:
             return [p for p in [pcf.get('PublicPort') for pcf in self.d.get('Ports')] if p]
         if self.d.HostConfig.PortBindings:
-            return list(self.d.HostConfig.PortBindings.keys())
+            # inspect data: host ports bound to container ports
+            return [int(b.get('HostPort'))
+                    for bindings in self.d.HostConfig.PortBindings.values()
+                    for b in (bindings or []) if b.get('HostPort')]
         return []
 
     @property
@@ -183,5 +186,5 @@ class BandContainer():
     @classmethod
     async def create_with_info(cls, *args, **kwargs):
         inst = cls(*args, **kwargs)
-        await inst.show()
+        await inst.fill()
         return inst
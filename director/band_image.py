@@ -1,14 +1,14 @@
-import subprocess
 from prodict import Prodict as pdict
 from typing import Dict
 
-from .constants import (DEF_LABELS, DEFAULT_DOCKERFILE, GIT_IGNORE_POSTFIX)
-from .helpers import tar_image_cmd
+from .constants import (DEF_LABELS, DEFAULT_DOCKERFILE, GIT_IGNORE_POSTFIX, BUILD_HASH_LABEL)
+from .build_context import ContextStreamer
 
 class BandImageBuilder:
-    def __init__(self, img, img_options):
+    def __init__(self, img, img_options, build_hash=None):
         self.img = img
         self.img_options = img_options
+        self.build_hash = build_hash
         self.dockerfile = self.img_options.get('dockerfile', DEFAULT_DOCKERFILE)
         # dockerfile_override = f'{dockerfile}.gen{GIT_IGNORE_POSTFIX}'
         # self.dockerfile_generator(
@@ -16,8 +16,8 @@ class BandImageBuilder:
         # self.dockerfile = dockerfile_override
 
     async def __aenter__(self):
-        self.p = subprocess.Popen(
-            tar_image_cmd(self.img.path), stdout=subprocess.PIPE)
+        self.context = ContextStreamer(
+            self.img.path, self.dockerfile, gzip=self.img_options.get('gzip', False))
         return self
 
     # def dockerfile_generator(self, path, orig, override):
@@ -31,19 +31,21 @@ class BandImageBuilder:
     def struct(self):
         return pdict.from_dict({
             'tag': self.img.name,
-            'fileobj': self.p.stdout,
-            'encoding': 'identity',
+            'context': self.context,
+            'encoding': self.context.encoding,
             'buildargs': self.img_options.get('buildargs', {}),
             'path_dockerfile': self.dockerfile,
             'nocache': self.img_options.get('nocache', False),
             'forcerm': self.img_options.get('forcerm', True),
             'rm': self.img_options.get('rm', True),
             'pull': self.img_options.get('pull', False),
+            'labels': {BUILD_HASH_LABEL: self.build_hash} if self.build_hash else None,
             'stream': True
         })
 
     async def __aexit__(self, exception_type, exception_value, traceback):
-        self.p.kill()
+        # stops archive producer if upload interrupted
+        self.context.close()
 
 
 class BandImage(pdict):
@@ -53,7 +55,6 @@ class BandImage(pdict):
     pos: Dict
     title: str
     base: str
-    p: subprocess.Popen
     d: pdict
     meta: pdict
 
@@ -85,5 +86,10 @@ class BandImage(pdict):
     def ports(self):
         return list(self.d.ContainerConfig.ExposedPorts.keys())
 
-    def create(self, img_options):
-        return BandImageBuilder(self, img_options)
+    @property
+    def build_hash(self):
+        labels = self.d.Config.Labels if self.d and self.d.Config else None
+        return (labels or {}).get(BUILD_HASH_LABEL)
+
+    def create(self, img_options, build_hash=None):
+        return BandImageBuilder(self, img_options, build_hash=build_hash)
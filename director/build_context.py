@@ -0,0 +1,263 @@
+"""
+Docker build context helpers.
+Walks service directory with .dockerignore semantics
+https://docs.docker.com/engine/reference/builder/#dockerignore-file
+"""
+import asyncio
+import hashlib
+import os
+import re
+import stat
+import tarfile
+import ujson
+
+from .constants import DEFAULT_DOCKERFILE
+
+DOCKERIGNORE = '.dockerignore'
+READ_CHUNK = 1 << 16
+# archive chunks handed over to event loop
+STREAM_CHUNK = 1 << 18
+STREAM_QUEUE = 16
+
+
+def pattern_regex(pattern):
+    """
+    Translate dockerignore pattern to regex.
+    Pattern matches path itself or any of it's parent directories
+    """
+    res = ''
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern[i:i + 2] == '**':
+                i += 2
+                if pattern[i:i + 1] == '/':
+                    i += 1
+                    res += '(?:.*/)?'
+                else:
+                    res += '.*'
+                continue
+            res += '[^/]*'
+        elif c == '?':
+            res += '[^/]'
+        elif c == '[':
+            j = pattern.find(']', i + 1)
+            if j < 0:
+                res += re.escape(c)
+            else:
+                res += '[' + pattern[i + 1:j].replace('\\', '\\\\') + ']'
+                i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            res += re.escape(pattern[i])
+        else:
+            res += re.escape(c)
+        i += 1
+    return re.compile(f'^{res}(?:/.*)?$', re.S)
+
+
+ARG_RE = re.compile(r'^\s*ARG\s+(\w+)(?:=(\S*))?', re.I)
+FROM_RE = re.compile(r'^\s*FROM\s+(?:--\S+\s+)*(\S+)', re.I)
+VAR_RE = re.compile(r'\$\{?(\w+)\}?')
+
+
+def dockerfile_base(path, dockerfile=DEFAULT_DOCKERFILE, buildargs=None):
+    """
+    Base image of first Dockerfile stage, build args substituted
+    """
+    try:
+        with open(os.path.join(path, dockerfile)) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    buildargs = buildargs or {}
+    args = {}
+    for line in lines:
+        m = ARG_RE.match(line)
+        if m:
+            args[m.group(1)] = buildargs.get(m.group(1), m.group(2) or '')
+            continue
+        m = FROM_RE.match(line)
+        if m:
+            return VAR_RE.sub(lambda v: args.get(v.group(1), ''), m.group(1))
+
+
+class DockerIgnore:
+    """
+    .dockerignore rules. Last matching rule wins, "!" marks exception
+    """
+
+    def __init__(self, lines=()):
+        self.rules = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            exception = line.startswith('!')
+            if exception:
+                line = line[1:].strip()
+            line = os.path.normpath(line).lstrip('/')
+            if line in ('', '.'):
+                continue
+            self.rules.append((pattern_regex(line), exception))
+        self.has_exceptions = any(exc for _, exc in self.rules)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(os.path.join(path, DOCKERIGNORE)) as f:
+                return cls(f.read().splitlines())
+        except FileNotFoundError:
+            return cls()
+
+    def excluded(self, relpath):
+        res = False
+        for regex, exception in self.rules:
+            if regex.match(relpath):
+                res = not exception
+        return res
+
+
+def context_entries(path, dockerfile=DEFAULT_DOCKERFILE):
+    """
+    Sorted relative paths of build context entries (dirs, files, symlinks).
+    Dockerfile and .dockerignore are always included like docker cli does
+    """
+    ignore = DockerIgnore.load(path)
+    keep = {os.path.normpath(dockerfile), DOCKERIGNORE}
+    res = []
+    for root, dirs, files in os.walk(path):
+        rel_root = os.path.relpath(root, path)
+        rel_root = '' if rel_root == '.' else rel_root + '/'
+        dirs.sort()
+        subdirs = []
+        for d in dirs:
+            rel = rel_root + d
+            excluded = ignore.excluded(rel)
+            if not excluded:
+                res.append(rel)
+            # excluded dir still walked when exceptions may re-include nested paths
+            if not excluded or ignore.has_exceptions:
+                subdirs.append(d)
+        dirs[:] = subdirs
+        for f in sorted(files):
+            rel = rel_root + f
+            if rel in keep or not ignore.excluded(rel):
+                res.append(rel)
+    res.sort()
+    return res
+
+
+def context_hash(path, dockerfile=DEFAULT_DOCKERFILE, params=None):
+    """
+    Build context fingerprint: entries names, modes, contents and build params.
+    Blocking, run in executor
+    """
+    h = hashlib.sha256()
+    h.update(ujson.dumps(params or {}, sort_keys=True).encode())
+    h.update(dockerfile.encode())
+    for rel in context_entries(path, dockerfile):
+        full = os.path.join(path, rel)
+        st = os.lstat(full)
+        h.update(b'\0' + rel.encode('utf-8', 'surrogateescape') + b'\0')
+        h.update(str(st.st_mode).encode())
+        if stat.S_ISLNK(st.st_mode):
+            h.update(os.readlink(full).encode('utf-8', 'surrogateescape'))
+        elif stat.S_ISREG(st.st_mode):
+            with open(full, 'rb') as f:
+                for block in iter(lambda: f.read(READ_CHUNK), b''):
+                    h.update(block)
+    return h.hexdigest()
+
+
+class _Aborted(Exception):
+    pass
+
+
+class _ChunksWriter:
+    """
+    File-like sink for tarfile, sends chunks of STREAM_CHUNK bytes to streamer
+    """
+
+    def __init__(self, streamer):
+        self.streamer = streamer
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= STREAM_CHUNK:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buf:
+            self.streamer._put(bytes(self.buf))
+            self.buf.clear()
+
+
+class ContextStreamer:
+    """
+    Build context as tar stream, optionally gzipped.
+    Archive is produced in executor thread, chunks pass to event loop through
+    bounded queue, so whole archive is never held in memory.
+    Usage: async for chunk in ContextStreamer(path)
+    """
+
+    def __init__(self, path, dockerfile=DEFAULT_DOCKERFILE, gzip=False):
+        self.path = path
+        self.dockerfile = dockerfile
+        self.gzip = gzip
+        self.loop = None
+        self.queue = None
+        self.aborted = False
+
+    @property
+    def encoding(self):
+        return 'gzip' if self.gzip else 'identity'
+
+    def _put(self, item):
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+        if self.aborted:
+            raise _Aborted()
+
+    def _produce(self):
+        try:
+            writer = _ChunksWriter(self)
+            with tarfile.open(fileobj=writer, mode='w|gz' if self.gzip else 'w|') as tar:
+                for rel in context_entries(self.path, self.dockerfile):
+                    tar.add(os.path.join(self.path, rel), arcname=rel, recursive=False)
+            writer.flush()
+            self._put(None)
+        except _Aborted:
+            pass
+        except Exception as exc:
+            if not self.aborted:
+                self._put(exc)
+
+    async def __aiter__(self):
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(STREAM_QUEUE)
+        self.aborted = False
+        producer = self.loop.run_in_executor(None, self._produce)
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+            if producer.done():
+                producer.result()
+
+    def close(self):
+        """
+        Stop producer, unblocking it if waiting for queue space
+        """
+        self.aborted = True
+        if self.queue:
+            while not self.queue.empty():
+                self.queue.get_nowait()
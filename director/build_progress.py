@@ -0,0 +1,83 @@
+import re
+import ujson
+from collections import deque
+from time import time
+
+from .constants import BUILD_PROGRESS_LINES, BUILD_RUNNING, BUILD_DONE, BUILD_FAILED
+
+STEP_RE = re.compile(r'Step\s(\d+)/(\d+)')
+
+
+class BuildProgress:
+    """
+    Image build state assembled from docker build stream chunks
+    """
+    __slots__ = ('name', 'state', 'step', 'total', 'layers', 'lines', 'started',
+                 'finished', 'image_id', 'error')
+
+    def __init__(self, name):
+        self.name = name
+        self.state = BUILD_RUNNING
+        self.step = 0
+        self.total = 0
+        # layer id -> [status, current bytes, total bytes]
+        self.layers = dict()
+        self.lines = deque(maxlen=BUILD_PROGRESS_LINES)
+        self.started = time()
+        self.finished = None
+        self.image_id = None
+        self.error = None
+
+    def feed(self, chunk):
+        stream = chunk.get('stream')
+        if stream:
+            m = STEP_RE.match(stream)
+            if m:
+                self.step, self.total = int(m.group(1)), int(m.group(2))
+            stream = stream.rstrip()
+            if stream:
+                self.lines.append(stream)
+            return
+        layer = chunk.get('id')
+        status = chunk.get('status')
+        if layer and status:
+            detail = chunk.get('progressDetail') or {}
+            rec = self.layers.get(layer)
+            if rec is None:
+                rec = self.layers[layer] = [status, 0, 0]
+            rec[0] = status
+            if detail:
+                rec[1] = detail.get('current', rec[1])
+                rec[2] = detail.get('total', rec[2])
+            return
+        aux = chunk.get('aux')
+        if aux:
+            self.image_id = aux.get('ID')
+        elif chunk.get('error'):
+            self.error = chunk['error']
+            self.lines.append(self.error)
+
+    def finish(self, error=None):
+        self.finished = time()
+        if error and not self.error:
+            self.error = error
+        self.state = BUILD_FAILED if self.error else BUILD_DONE
+
+    @property
+    def elapsed(self):
+        return (self.finished or time()) - self.started
+
+    def as_dict(self):
+        return dict(
+            name=self.name,
+            state=self.state,
+            step=self.step,
+            total=self.total,
+            layers={k: dict(status=s, current=c, total=t) for k, (s, c, t) in self.layers.items()},
+            elapsed=round(self.elapsed, 1),
+            lines=list(self.lines),
+            image_id=self.image_id,
+            error=self.error)
+
+    def to_json(self):
+        return ujson.dumps(dict(type='build_progress', **self.as_dict()))
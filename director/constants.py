@@ -3,17 +3,109 @@ STATUS_STARTING = 'starting'
 STATUS_RESTARTING = 'restarting'
 STATUS_REMOVING = 'removing'
 STATUS_STOPPING = 'stopping'
+
+# service operations
+OP_RUN = 'run'
+OP_STOP = 'stop'
+OP_START = 'start'
+OP_REMOVE = 'remove'
+OP_RESTART = 'restart'
 SYSTEM_CONTAINERS = [
     'chproxy', 'grafana', 'anaconda', 'openvpn', 'theia', 'heavyload',
     'front'
 ]
 DEF_LABELS = {'inband': 'inband'}
 STARTED_SET = 'started'
+# docker container events affecting containers cache
+CACHE_EVENTS = {
+    'create', 'start', 'restart', 'die', 'stop', 'kill', 'pause', 'unpause',
+    'rename', 'update', 'destroy', 'health_status'
+}
 SERVICE_TIMEOUT = 30
+# app state polling, seconds
+HEALTH_INTERVAL = 10
+HEALTH_DEADLINE = 5
+HEALTH_MAX_BACKOFF = 120
+# status request latency histogram buckets, ms
+HEALTH_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# stats cache: fresh period, max age served while refreshing, seconds
+STAT_TTL = 30
+STAT_MAX_STALE = 600
+# caller wait for first load, seconds
+STAT_WAIT = 1
+STAT_QUERY_TIMEOUT = 30
+STAT_KEYS_KEEP = 64
+# events rollup: bucket size, window, full recompute interval, seconds
+STAT_STEP = 900
+STAT_WINDOW = 86400
+STAT_FULL_INTERVAL = 3600
+# stats range limits and steps picked to fit STAT_MAX_POINTS buckets, seconds
+STAT_MIN_RANGE = 3600
+STAT_MAX_RANGE = 90 * 86400
+STAT_STEPS = (60, 300, 900, 3600, 14400, 86400)
+STAT_MAX_POINTS = 200
+# ranges from which SAMPLE applied when stat_sample configured
+STAT_SAMPLE_RANGE = 7 * 86400
+# registrations changes kept for incremental frontier updates
+REGS_JOURNAL_SIZE = 1000
+# container stats samples kept per service
+STATS_WINDOW = 60
+# max seconds between stats samples counted as uptime
+STATS_MAX_GAP = 5
 DEFAULT_COL = 0
 DEFAULT_ROW = 2
 
+# log subscribers queues
+LOGS_QUEUE_SIZE = 1000
+LOGS_QUEUE_MAX_SIZE = 10000
+LOGS_BATCH_SIZE = 200
+LOGS_BATCH_MAX_MS = 5000
+# log records kept in memory per service
+LOGS_HISTORY_SIZE = 1000
+# logs persistence
+LOGS_TABLE = 'logs'
+LOGS_SHIP_BATCH = 500
+LOGS_SHIP_INTERVAL = 1
+LOGS_SHIP_BUFFER = 20000
+LOGS_SHIP_MAX_DELAY = 30
+LOGS_SHIP_RETRIES = 5
+LOGS_SHIP_TIMEOUT = 10
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_DISCONNECT = 'disconnect'
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_DISCONNECT)
+
 SHARED_CONFIG_KEY = '__shared__'
+# redis pool size and command timeout, seconds
+REDIS_POOL_SIZE = 10
+REDIS_TIMEOUT = 5
 
 DEFAULT_DOCKERFILE = 'Dockerfile'
+# build scheduler
+BUILD_MEM_PER_JOB = 2 * 1024 ** 3
+BUILD_JOBS_KEEP = 20
+BUILD_QUEUED = 'queued'
+BUILD_WAITING_BASE = 'waiting_base'
+BUILD_RUNNING = 'running'
+BUILD_DONE = 'done'
+BUILD_FAILED = 'failed'
+# build output lines kept in progress
+BUILD_PROGRESS_LINES = 20
+# min interval between build progress pushes, seconds
+BUILD_PROGRESS_PUSH = 1
+# image label holding build context hash
+BUILD_HASH_LABEL = 'band.build.hash'
+# container lifecycle waits, seconds
+CONTAINER_STOP_TIMEOUT = 10
+CONTAINER_REMOVE_TIMEOUT = 15
+# blue/green deploy containers names suffixes
+BLUE_GREEN_CANDIDATE = '--next'
+BLUE_GREEN_RETIRED = '--prev'
+# new container status reply wait, seconds
+BLUE_GREEN_READY_TIMEOUT = 60
+BLUE_GREEN_POLL = 0.5
+# ports reservations storage key
+PORTS_KEY = 'ports'
+# pending reservation lifetime, seconds
+PORTS_PENDING_TTL = 600
 GIT_IGNORE_POSTFIX = '.gignore'
@@ -13,16 +13,14 @@ import aiofiles
 import os
 import sys
 import stat
-import struct
-import re
 import asyncio
 import aiodocker
 import ujson
-import subprocess
 from aiodocker.exceptions import DockerError
 from aiodocker.logs import DockerLog
-from aiodocker.channel import Channel, ChannelSubscriber
 from aiodocker.containers import DockerContainer
+from aiodocker.jsonstream import json_stream_stream
+from aiodocker.utils import clean_map
 from prodict import Prodict as pdict
 from time import time
 from typing import Set, List, Dict
@@ -31,17 +29,35 @@ from pprint import pprint
 from band import logger, scheduler, loop
 from .image_navigator import ImageNavigator
 from .band_container import BandContainer, BandContainerBuilder
-from .constants import DEF_LABELS, STATUS_RUNNING
-from .helpers import req_to_bool, def_val
+from .metrics import ServiceMetrics
+from .log_broker import LogBroker
+from .log_shipper import LogShipper
+from .log_history import LogHistory
+from .log_parser import LogFrameParser
+from .ports import PortAllocator
+from .constants import (
+    DEF_LABELS, STATUS_RUNNING, CACHE_EVENTS, DEFAULT_DOCKERFILE, BUILD_PROGRESS_PUSH,
+    PORTS_KEY, PORTS_PENDING_TTL, CONTAINER_STOP_TIMEOUT, CONTAINER_REMOVE_TIMEOUT,
+    BLUE_GREEN_CANDIDATE, BLUE_GREEN_RETIRED)
+from .build_context import context_hash
+from .build_progress import BuildProgress
+from .helpers import req_to_bool, def_val, PhaseTimer
 from .flake import Flake
 from .structs import LogRecord
-from base64 import b64encode
 
 idgen = Flake()
-logs_sources = {
-    '1': 'stdin',
-    '2': 'stderr'
-}
+
+
+def candidate_name(name):
+    return f'{name}{BLUE_GREEN_CANDIDATE}'
+
+
+def retired_name(name):
+    return f'{name}{BLUE_GREEN_RETIRED}'
+
+
+def is_transient(name):
+    return name.endswith((BLUE_GREEN_CANDIDATE, BLUE_GREEN_RETIRED))
 
 
 """
@@ -93,7 +109,7 @@ logs_sources = {
 
 class DockerManager():
     image_navigator: ImageNavigator
-    reserved_ports: Set
+    ports: PortAllocator
     container_params: pdict
 
     def __init__(self,
@@ -103,6 +119,9 @@ class DockerManager():
                  image_navigator,
                  start_port=8900,
                  end_port=8999,
+                 reconcile_interval=60,
+                 inspect_concurrency=8,
+                 band_config=None,
                  **kwargs):
         # instance of low-level async docker client
         self.dc = aiodocker.Docker()
@@ -112,82 +131,220 @@ class DockerManager():
         self.start_port = start_port
         # pool end port
         self.end_port = end_port
-        # ports reservation
-        self.reserved_ports = set()
+        # host ports allocator, seeded from containers and kept in sync by events
+        self.ports = PortAllocator(start_port, end_port)
+        # ports reservations storage
+        self.band_config = band_config
         # common container params
         self.container_params = pdict.from_dict(container_params)
         self.image_params = pdict.from_dict(image_params)
+        # inband containers cache: id -> BandContainer, kept in sync by docker events
+        self._cache = dict()
+        # containers cache index: name -> id
+        self._names = dict()
+        # ids changed by events while reconcile lists containers, None when not running
+        self._touched = None
+        # full cache rebuild interval, safety net for missed events
+        self.reconcile_interval = reconcile_interval
+        # max simultaneous inspect requests
+        self.inspect_concurrency = inspect_concurrency
+        # containers metrics: name -> ServiceMetrics
+        self.metrics = dict()
+        # containers ids with active stats stream
+        self._stats_streams = set()
+        # containers log records fan-out
+        self.logs = LogBroker()
+        # log records persistence
+        self.log_shipper = LogShipper(self.logs)
+        # recent log records per service
+        self.log_history = LogHistory()
+        # last image build progress per service
+        self.build_progress = dict()
+        # last redeploy phases durations per service
+        self.deploy_timings = dict()
 
     async def initialize(self):
-        self.logs = Channel()
-        self.stats = Channel()
+        # subscribing before seeding cache, so events fired in between are not lost
+        events = self.dc.events.subscribe()
+        await self.reconcile(reserved=await self.load_ports())
 
+        await scheduler.spawn(self.log_shipper.run())
         await scheduler.spawn(
-            self.events_reader(self.dc, self.logs))
-
-
-    async def stats_reader(self, container: DockerContainer,):
-            
-            async for stat in container.stats():
-                logger.debug('stat', s=stat)
-
-            # stat=dict(
-            #     sla=0,
-            #     mem=0,
-            #     cpu=0,
-            # ),
+            self.events_reader(self.dc, events, self.logs))
+        await scheduler.spawn(self.reconcile_worker())
+
+    """
+    Containers cache
+    """
+
+    async def reconcile(self, reserved=None):
+        """
+        Sync containers cache with docker and rebuild ports pool.
+        Snapshot is merged into live cache, containers changed by events
+        while listing keep their newer state
+        """
+        filters = ujson.dumps(dict(label=['inband']))
+        self._touched = set()
+        try:
+            containers = await self.dc.containers.list(all=True, filters=filters)
+            snapshot = {bc.id: bc for bc in await self.inspect_many(containers)}
+        finally:
+            touched, self._touched = self._touched, None
+        for cid in set(self._cache) - set(snapshot) - touched:
+            self._cache_drop(cid)
+        for cid, bc in snapshot.items():
+            if cid not in touched:
+                self._cache_put(bc)
+        self.ports.seed(((bc.name, cid, bc.ports) for cid, bc in self._cache.items()), reserved)
+        self.ports.expire(PORTS_PENDING_TTL)
+        await self.save_ports()
+
+    async def reconcile_worker(self):
+        while True:
+            try:
+                await asyncio.sleep(self.reconcile_interval)
+                await self.reconcile()
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                logger.exception('containers cache reconcile')
+
+    def _cache_put(self, bc):
+        if self._touched is not None:
+            self._touched.add(bc.id)
+        prev = self._cache.get(bc.id)
+        if prev and self._names.get(prev.name) == bc.id:
+            del self._names[prev.name]
+        self._cache[bc.id] = bc
+        self._names[bc.name] = bc.id
+        self.ports.observe(bc.name, bc.id, bc.ports, live=self._cache)
+
+    def _cache_drop(self, cid):
+        if self._touched is not None:
+            self._touched.add(cid)
+        bc = self._cache.pop(cid, None)
+        if bc and self._names.get(bc.name) == cid:
+            del self._names[bc.name]
+        if bc:
+            self.ports.release(bc.name, cid)
+        return bc
+
+    async def handle_container_event(self, event):
+        """
+        Apply docker container event to cache.
+        Event action may contain details, for example "health_status: healthy"
+        """
+        action = event['Action'].split(':')[0]
+        if action not in CACHE_EVENTS:
+            return
+        cid = event['Actor']['ID']
+        if action == 'destroy':
+            self._cache_drop(cid)
+        else:
+            try:
+                self._cache_put(BandContainer(await self.dc.containers.get(cid)))
+            except DockerError as exc:
+                if exc.status == 404:
+                    self._cache_drop(cid)
+                else:
+                    logger.warn('container event inspect failed',
+                                status=exc.status, message=exc.message)
+        await self.save_ports()
+
+    def cached(self, status=None):
+        """
+        Inband containers from cache. No docker requests
+        """
+        return [bc for bc in self._cache.values()
+                if not status or bc.status == status]
+
+    def cached_get(self, name):
+        cid = self._names.get(name)
+        if cid:
+            return self._cache.get(cid)
+
+
+    async def stats_reader(self, container: DockerContainer, name, cid):
+        """
+        Consume container stats stream into service metrics.
+        Stream ends by docker when container stops
+        """
+        if cid in self._stats_streams:
+            return
+        self._stats_streams.add(cid)
+        metrics = self.metrics.get(name)
+        if not metrics:
+            metrics = self.metrics[name] = ServiceMetrics()
+        try:
+            async for sample in container.stats():
+                metrics.push(sample)
+        except DockerError as exc:
+            logger.warn('stats stream failed', name=name, status=exc.status, message=exc.message)
+        finally:
+            metrics.stream_closed()
+            self._stats_streams.discard(cid)
 
+    def service_metrics(self, name):
+        return self.metrics.get(name)
 
-    async def logs_reader(self, docker, container: DockerContainer, channel: Channel, name, cid):
+    async def logs_reader(self, docker, container: DockerContainer, broker: LogBroker, name, cid):
         log_reader = container.logs
         subscriber = log_reader.subscribe()
         unixts = int(time())
         
         await scheduler.spawn(log_reader.run(since=unixts))
+        parser = LogFrameParser()
         while True:
-            log_record = await subscriber.get()
-            ts, id = idgen.take()
-            if log_record is None:
+            chunk = await subscriber.get()
+            if chunk is None:
                 logger.info('closing docker logs reader')
                 break
-            mv = memoryview(log_record)
-            if len(log_record) <= 8:
-                logger.warn('small shit', len=len(log_record), b64val=b64encode(log_record).decode())
-                continue
-            message = bytes(mv[8:]).decode('utf-8', 'replace')
-            source = logs_sources.get(str(mv[0]), '')
-            size = struct.unpack('>L', mv[4:8])[0]
-            
-            msg = LogRecord(id, ts, cid, name, source, size, message)
-            await channel.publish(msg)
-
-    async def events_reader(self, docker, logs):
-        subscriber = docker.events.subscribe()
-
-        for bc in await self.containers(inband=False, status='running'):
+            # container may be renamed by blue/green deploy
+            bc = self._cache.get(cid)
+            cname = bc.name if bc else name
+            for source, size, message in parser.feed(chunk):
+                ts, id = idgen.take()
+                msg = LogRecord(id, ts, cid, cname, source, size, message)
+                self.log_history.append(msg)
+                broker.publish(msg)
+
+    async def events_reader(self, docker, subscriber, logs):
+        for bc in await self.containers(inband=False, status='running', list_only=True):
             container = bc.container
             await scheduler.spawn(self.logs_reader(docker, container, logs, bc.name, bc.id))
-            await scheduler.spawn(self.stats_reader(container))
+            if bc.inband():
+                await scheduler.spawn(self.stats_reader(container, bc.name, bc.id))
             
             logger.debug(f'creating logger for {bc.name}')
         while True:
             event = await subscriber.get()
             if event is None:
                 break
-            if event['Action'] != 'start' or event['Type'] != 'container':
+            if event['Type'] != 'container':
                 continue
             # Not a band container
             if 'inband' not in event['Actor']['Attributes']:
                 continue
+            await self.handle_container_event(event)
+            if event['Action'] != 'start':
+                continue
             cid = event['Actor']['ID']
-            container = await docker.containers.get(cid)
-            name = event['Actor']['Attributes']['name']
-            await scheduler.spawn(self.logs_reader(docker, container, logs, name, cid))
-
-    def get_log_reader(self):
-        return self.logs.subscribe()
-
-    async def containers(self, as_dict=False, status=None, fullinfo=False, inband=True):
+            bc = self._cache.get(cid)
+            if not bc:
+                continue
+            await scheduler.spawn(self.logs_reader(docker, bc.container, logs, bc.name, cid))
+            await scheduler.spawn(self.stats_reader(bc.container, bc.name, cid))
+
+    def get_log_reader(self, **kwargs):
+        return self.logs.subscribe(**kwargs)
+
+    async def containers(self, as_dict=False, status=None, fullinfo=False, inband=True,
+                         list_only=False, concurrency=None):
+        """
+        List containers.
+        list_only - skip inspect requests, /containers/json fields only (state, ports, labels, names)
+        concurrency - max simultaneous inspect requests
+        """
         filters = pdict()
         if inband:
             filters.label = ['inband']
@@ -195,15 +352,32 @@ class DockerManager():
             filters.status = [status]
         
         containers = await self.dc.containers.list(all=True, filters=ujson.dumps(filters))
-        lst = []
-        for c in containers:
-            bc = await BandContainer.create_with_info(c)
-            lst.append(bc)
-        
+        if list_only:
+            lst = [BandContainer(c) for c in containers]
+        else:
+            lst = await self.inspect_many(containers, concurrency=concurrency)
+
         return lst if not as_dict else {c.name: c for c in lst}
 
+    async def inspect_many(self, containers, concurrency=None):
+        """
+        Inspect containers concurrently, at most `concurrency` requests at once.
+        Containers removed in the meantime are skipped
+        """
+        sem = asyncio.Semaphore(concurrency or self.inspect_concurrency)
+
+        async def inspect(c):
+            async with sem:
+                try:
+                    return await BandContainer.create_with_info(c)
+                except DockerError as exc:
+                    if exc.status != 404:
+                        raise
+
+        return [bc for bc in await asyncio.gather(*map(inspect, containers)) if bc]
+
     async def conts_list(self):
-        cs = await self.containers()
+        cs = await self.containers(list_only=True)
         return [c.short_info for c in cs]
 
     async def get(self, name):
@@ -217,53 +391,91 @@ class DockerManager():
 
         # return (await self.containers()).get(name, None)
 
-    async def available_ports(self):
-        available_ports = set(range(self.start_port, self.end_port))
-        conts = await self.containers(fullinfo=True)
-        used_ports = set()
-
-        for cont in conts:
-            cports = cont.ports
-            logger.info('container ports', cname=cont.name, cports=cports)
-            if not cports:
-                logger.warn('no ports',  cname=cont.name, cports=cports)
-            for p in cports:
-                used_ports.add(p)
-
-        logger.info(f"ports used summary", used_ports=used_ports)
-        return available_ports - used_ports - self.reserved_ports
-
-    def hold_ports(self, ports):
-        for port in ports:
-            self.reserved_ports.add(port)
-
-    def free_ports(self, ports):
-        for port in ports:
-            self.reserved_ports.add(port)
+    async def find(self, name, inband=True):
+        """
+        Lookup container by name: cache hit or single inspect request
+        """
+        bc = self.cached_get(name)
+        if bc:
+            return bc
+        bc = await self.get(name)
+        if bc and (not inband or bc.inband()):
+            return bc
+
+    """
+    Ports reservations
+    """
+
+    async def load_ports(self):
+        """
+        Pending reservations persisted by previous director run
+        """
+        if not self.band_config:
+            return None
+        try:
+            stored = await self.band_config.hash_get(PORTS_KEY)
+        except Exception:
+            logger.exception('ports reservations load')
+            return None
+        return {name: (r['ports'], r.get('ts'))
+                for name, r in stored.items()
+                if r and r.get('cid') is None and r.get('ports')}
+
+    async def save_ports(self):
+        """
+        Persist reservations changed since last save
+        """
+        changed = self.ports.take_dirty()
+        if not changed or not self.band_config:
+            return
+        try:
+            removed = [name for name, r in changed.items() if r is None]
+            if removed:
+                await self.band_config.hash_rm(PORTS_KEY, *removed)
+            for name, r in changed.items():
+                if r is not None:
+                    await self.band_config.hash_set(PORTS_KEY, name, r)
+        except Exception:
+            self.ports.dirty.update(changed)
+            logger.exception('ports reservations save')
+
+    async def wait_removed(self, container, timeout=CONTAINER_REMOVE_TIMEOUT):
+        """
+        Wait until docker removes container. False on timeout
+        """
+        try:
+            await asyncio.wait_for(container.wait(condition='removed'), timeout)
+        except DockerError as exc:
+            # already gone
+            if exc.status != 404:
+                raise
+        except asyncio.TimeoutError:
+            return False
+        return True
 
     async def remove_container(self, name):
-        # removing if running
+        """
+        Stop and delete container. Returns when container name is free
+        """
         try:
             container = BandContainer(await self.dc.containers.get(name))
-            if container:
-                await container.fill()
-                if container.state == 'running':
-                    container_autoremove = container.auto_removable()
-                    logger.info("Stopping container")
-                    await container.stop()
-                    if not container_autoremove:
-                        await container.delete()
-                else:
-                    await container.delete()
-                
-                await asyncio.sleep(0.5)
-                # try:
-                #     await container.wait(condition="removed")
-                # except DockerError as e:
-                #     logger.debug('Docker 404 received on wait request')
-                #     if e.status != 404:
-                #         raise e
-
+            await container.fill()
+            removed = None
+            if container.state == 'running':
+                if container.auto_removable():
+                    # subscribing before stop, removal follows right after exit
+                    removed = asyncio.ensure_future(self.wait_removed(container))
+                logger.info("Stopping container", name=name)
+                try:
+                    await container.stop(t=CONTAINER_STOP_TIMEOUT)
+                except BaseException:
+                    if removed:
+                        removed.cancel()
+                    raise
+            if not removed or not await removed:
+                # delete request returns when container is removed
+                await container.delete(force=True)
+            self._cache_drop(container.id)
         except DockerError as exc:
             if exc.status == 404:
                 pass
@@ -272,61 +484,95 @@ class DockerManager():
         return True
 
     async def stop_container(self, name):
-        conts = await self.containers(as_dict=True)
-        if name in conts.keys():
-            c = conts[name]
+        c = await self.find(name)
+        if c:
             logger.info(f"stopping container {c.name}")
             await c.stop()
             return True
 
     async def start_container(self, name):
-        conts = await self.containers(as_dict=True)
-        if name in conts.keys():
-            c = conts[name]
+        c = await self.find(name)
+        if c:
             logger.info(f"starting container {c.name}")
             await c.start()
             return True
 
     async def restart_container(self, name):
-        conts = await self.containers(as_dict=True)
-        if name in conts.keys():
-            c = conts[name]
+        c = await self.find(name)
+        if c:
             logger.info(f"restarting container {c.name}")
             await c.restart()
             return True
 
-    async def create_image(self, img, img_options):
+    async def image_info(self, name):
+        try:
+            return await self.dc.images.inspect(name)
+        except DockerError as exc:
+            if exc.status != 404:
+                raise
+
+    async def build_hash(self, img, img_options):
+        """
+        Fingerprint of build context and build params.
+        Base image id included, so base rebuild invalidates services images
+        """
+        base = img_options.get('buildargs', {}).get('BASE_CONTAINER')
+        base_info = base and await self.image_info(base)
+        params = dict(img_options, base_id=base_info and base_info.get('Id'))
+        dockerfile = img_options.get('dockerfile', DEFAULT_DOCKERFILE)
+        return await loop.run_in_executor(None, context_hash, img.path, dockerfile, params)
+
+    async def build_stream(self, tag, context, encoding, path_dockerfile=None, buildargs=None,
+                           labels=None, nocache=False, forcerm=True, rm=True, pull=False, **kwargs):
+        """
+        Same as images.build, but takes async iterable context.
+        aiodocker reads build fileobj synchronously, blocking event loop
+        """
+        params = dict(t=tag, rm=rm, pull=pull, nocache=nocache, forcerm=forcerm,
+                      dockerfile=path_dockerfile)
+        if buildargs:
+            params['buildargs'] = ujson.dumps(buildargs)
+        if labels:
+            params['labels'] = ujson.dumps(labels)
+        headers = {'content-type': 'application/x-tar', 'Content-Encoding': encoding}
+        async with self.dc._query('build', 'POST', params=clean_map(params),
+                                  headers=headers, data=context) as response:
+            async for chunk in json_stream_stream(response):
+                yield chunk
+
+    async def create_image(self, img, img_options, name=None):
+        build_hash = await self.build_hash(img, img_options)
+        if not img_options.get('nocache'):
+            info = await self.image_info(img.name)
+            if info and img.set_data(info).build_hash == build_hash:
+                logger.info('Image is up to date, build skipped', n=img.name, build_hash=build_hash)
+                return img
         logger.debug("Building image", n=img.name, io=img_options, path=img.path)
-        async with img.create(img_options) as builder:
-            progress = pdict()
+        progress = self.build_progress[name or img.key] = BuildProgress(name or img.key)
+        async with img.create(img_options, build_hash=build_hash) as builder:
             struct = builder.struct()
-            last_time = time()
-            async for chunk in self.dc.images.build(**struct):
-                if isinstance(chunk, dict):
-                    if chunk.get('aux'):
-                        struct.id = chunk.get('aux').get('ID')
-                        logger.debug('chunk', chunk=chunk)
-                    elif chunk.get('status') and chunk.get('id'):
-                        progress[chunk.get('id')] = chunk
-                        if time() - last_time > 1:
-                            logger.info("\nDocker build progress", progress=progress)
-                            last_time = time()
-                    elif chunk.get('stream'):
-                        # logger.debug('chunk', chunk=chunk)
-                        step = re.search(r'Step\s(\d+)\/(\d+)', chunk.get('stream'))
-                        if step:
-                            logger.debug('Docker build step ', groups=step.groups())
-                    else:
-                        logger.debug('unknown chunk', chunk=chunk)
-                else:
-                    logger.debug('unknown chunk type', type=type(chunk), chunk=chunk)
-            if not struct.id:
-                raise Exception('Build process not completed')
-            logger.info('Docker image created', struct_id=struct.id)
+            last_push = 0
+            try:
+                async for chunk in self.build_stream(**struct):
+                    if isinstance(chunk, dict):
+                        progress.feed(chunk)
+                    now = time()
+                    if now - last_push > BUILD_PROGRESS_PUSH:
+                        self.logs.broadcast(progress.to_json(), name=progress.name)
+                        last_push = now
+                if progress.error or not progress.image_id:
+                    raise Exception(f'Build process not completed: {progress.error}')
+            except Exception as exc:
+                progress.finish(error=str(exc))
+                raise
+            finally:
+                if not progress.finished:
+                    progress.finish()
+                self.logs.broadcast(progress.to_json(), name=progress.name)
+            logger.info('Docker image created', image_id=progress.image_id, elapsed=progress.elapsed)
             return img.set_data(await self.dc.images.get(img.name))
 
-    async def run_container(self, name, env={}, nocache=None, auto_remove=None, **kwargs):
-
+    def _run_options(self, nocache, auto_remove, env, kwargs):
         image_options = dict(
             nocache=def_val(nocache, False),
             **self.image_params
@@ -341,21 +587,49 @@ class DockerManager():
                         kwargs=kwargs),
                     image_options=image_options, 
                     container_options=container_options)
+        return image_options, container_options
+
+    async def run_container(self, name, env={}, nocache=None, auto_remove=None, **kwargs):
+        image_options, container_options = self._run_options(nocache, auto_remove, env, kwargs)
 
+        timer = PhaseTimer()
         # building image
         service_img = self.image_navigator[name]
 
         logger.info('Building image', name=name)
-        await self.create_image(service_img, image_options)
+        with timer.phase('build'):
+            await self.create_image(service_img, image_options, name=name)
         logger.info('Removing active container', name=name)
-        
-        await self.remove_container(name)
-        await asyncio.sleep(0.1)
+        with timer.phase('remove'):
+            await self.remove_container(name)
+        c = await self._create_container(name, service_img, env, container_options, timer)
+        return c.short_info
+
+    async def run_candidate(self, name, env={}, nocache=None, auto_remove=None, **kwargs):
+        """
+        Blue/green deploy: build image and start new container next to running one,
+        under temporary name (container and hostname, so rpc name too) on fresh ports.
+        Returns (container, timer)
+        """
+        image_options, container_options = self._run_options(nocache, auto_remove, env, kwargs)
+
+        timer = PhaseTimer()
+        service_img = self.image_navigator[name]
+        candidate = candidate_name(name)
+        with timer.phase('build'):
+            await self.create_image(service_img, image_options, name=name)
+        with timer.phase('remove'):
+            # leftover of interrupted deploy
+            await self.remove_container(candidate)
+        c = await self._create_container(
+            candidate, service_img, env, container_options, timer, service=name)
+        return c, timer
+
+    async def _create_container(self, name, service_img, env, container_options, timer,
+                                service=None):
         # preparing to run
-        available_ports = await self.available_ports()
-        allocated_ports = list(available_ports.pop()
-                               for p in service_img.ports)
-        self.hold_ports(allocated_ports)
+        allocated_ports = self.ports.allocate(name, len(service_img.ports))
+        await self.save_ports()
         try:
             params = pdict.from_dict({
                 **dict(host_ports=allocated_ports),
@@ -364,16 +638,63 @@ class DockerManager():
             builder = BandContainerBuilder(service_img)
             config = builder.run_struct(name, **container_options, **params)
             # running service
-            logger.info(f"starting container {name}.")
-            dc = await self.dc.containers.run(config=config, name=name)
-            c = BandContainer(dc)
-            await c.ensure_filled()
-            logger.info(f'started container {c.name} [{c.short_id}] {c.ports}')
-            return c.short_info
-        except Exception as exc:
-            raise exc
+            logger.info(f"creating container {name}.")
+            with timer.phase('create'):
+                dc = await self.dc.containers.create(config=config, name=name)
+            self.ports.bind(name, dc.id)
+            with timer.phase('start'):
+                await dc.start()
+                c = BandContainer(dc)
+                await c.fill()
+            self._cache_put(c)
+            self.deploy_timings[service or name] = timer.summary()
+            logger.info(f'started container {c.name} [{c.short_id}] {c.ports}',
+                        timings=timer.summary())
+            return c
+        except (Exception, asyncio.CancelledError):
+            if self.ports.pending(name):
+                self.ports.release(name)
+            raise
         finally:
-            self.free_ports(allocated_ports)
+            await self.save_ports()
+
+    async def promote(self, name, candidate):
+        """
+        Blue/green deploy: give service name to candidate container.
+        Previous container renamed and returned, caller removes it
+        """
+        current = await self.find(name)
+        retired = retired_name(name)
+        if current:
+            await self.remove_container(retired)
+            await current.rename(retired)
+            self.ports.rename(name, retired)
+            await current.fill()
+            self._cache_put(current)
+        cname = candidate.name
+        try:
+            await candidate.rename(name)
+        except (Exception, asyncio.CancelledError):
+            # giving name back, service should not stay without container
+            if current:
+                logger.warn('candidate rename failed, restoring current', name=name)
+                await current.rename(name)
+                self.ports.rename(retired, name)
+                await current.fill()
+                self._cache_put(current)
+                await self.save_ports()
+            raise
+        self.ports.rename(cname, name)
+        await candidate.fill()
+        self._cache_put(candidate)
+        # service metrics follow service name
+        if cname in self.metrics:
+            self.metrics[name] = self.metrics.pop(cname)
+        await self.save_ports()
+        logger.info('container promoted', name=name, cid=candidate.short_id,
+                    retired=current and current.short_id)
+        return current
 
     async def close(self):
+        self.logs.close()
         await self.dc.close()
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+from time import time
 from inflection import underscore
 from prodict import Prodict
 
@@ -15,18 +17,6 @@ def isn(arg):
     return arg == None
 
 
-def tar_image_cmd(path):
-    """
-    Method for build tar image from source path
-    """
-    # -c create archive mode
-    # -C directory In c and r mode, this changes the directory before adding the following files.
-    # -X filename Read a list of exclusion patterns from the specified file.
-    # --exclude pattern Do not process files or directories that match the specified pattern.
-    # tar -C ___ -c -X ___/.dockerignore .
-    return ['tar', '-C', f'{path}', '-c', '-X', f'{path}/.dockerignore', '.']
-
-
 def req_to_bool(v) -> None or bool:
     if v == None:
         return v
@@ -35,6 +25,12 @@ def req_to_bool(v) -> None or bool:
     return str(v).lower() in ("yes", "true", "t", "1")
 
 
+def req_to_int(v) -> None or int:
+    if v == None or v == '':
+        return None
+    return int(v)
+
+
 def underdict(obj):
     if isinstance(obj, dict):
         new_dict = {}
@@ -71,3 +67,24 @@ def merge_dicts(*args):
     for d2 in args[1:]:
         d.update(d2)
     return d
+
+
+class PhaseTimer:
+    """
+    Durations of named phases, ms
+    """
+
+    def __init__(self):
+        self.started = time()
+        self.phases = dict()
+
+    @contextmanager
+    def phase(self, name):
+        start = time()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time() - start) * 1000, 1)
+
+    def summary(self):
+        return dict(self.phases, total=round((time() - self.started) * 1000, 1))
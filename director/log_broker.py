@@ -0,0 +1,280 @@
+import asyncio
+import re
+import ujson
+from collections import deque
+from time import gmtime, strftime
+
+from band import logger
+
+from .constants import (
+    LOGS_QUEUE_SIZE, LOGS_BATCH_SIZE, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DISCONNECT, OVERFLOW_POLICIES)
+
+
+def record_json(rec):
+    """
+    Log record websocket representation
+    """
+    return ujson.dumps({
+        'id': rec.id,
+        'cid': rec.cid,
+        'cname': rec.name,
+        'time': strftime('%m%d %H:%M:%S', gmtime(rec.ts // 1000)) + f'.{rec.ts % 1000:03d}',
+        'ts': rec.ts,
+        'source': rec.source,
+        'data': rec.message
+    })
+
+
+def as_list(val):
+    if val is None or val == '':
+        return []
+    if isinstance(val, (list, tuple, set)):
+        return [str(v) for v in val]
+    return [str(val)]
+
+
+class LogFilter:
+    """
+    Server-side log records selection.
+    Empty criteria matches any record
+    """
+    __slots__ = ('names', 'ids', 'sources', 'since_id', 'since_ts', 'substr', 'pattern')
+
+    def __init__(self, names=None, ids=None, sources=None, since_id=None, since_ts=None,
+                 grep=None, regex=False):
+        self.names = frozenset(names) if names else None
+        # full or short containers ids
+        self.ids = tuple(ids) if ids else None
+        self.sources = frozenset(sources) if sources else None
+        self.since_id = since_id
+        self.since_ts = since_ts
+        self.substr = None
+        self.pattern = None
+        if grep:
+            if regex:
+                self.pattern = re.compile(grep)
+            else:
+                self.substr = grep
+
+    def match_name(self, name):
+        return self.names is None or name in self.names
+
+    def match(self, rec):
+        if self.names is not None and rec.name not in self.names:
+            return False
+        if self.ids is not None and not rec.cid.startswith(self.ids):
+            return False
+        if self.sources is not None and rec.source not in self.sources:
+            return False
+        if self.since_id is not None and rec.id <= self.since_id:
+            return False
+        if self.since_ts is not None and rec.ts < self.since_ts:
+            return False
+        if self.substr is not None and self.substr not in rec.message:
+            return False
+        if self.pattern is not None and not self.pattern.search(rec.message):
+            return False
+        return True
+
+    @classmethod
+    def from_request(cls, params):
+        """
+        Build filter from client subscription message.
+        Raises ValueError on malformed params
+        """
+        if not isinstance(params, dict):
+            raise ValueError('subscription params should be an object')
+        try:
+            since_id = params.get('since_id')
+            since_ts = params.get('since_ts')
+            return cls(
+                names=as_list(params.get('names')),
+                ids=as_list(params.get('ids')),
+                sources=as_list(params.get('sources', params.get('source'))),
+                since_id=int(since_id) if since_id is not None else None,
+                since_ts=int(since_ts) if since_ts is not None else None,
+                grep=params.get('grep') or None,
+                regex=bool(params.get('regex')))
+        except re.error as exc:
+            raise ValueError(f'bad regex: {exc}')
+        except TypeError as exc:
+            raise ValueError(str(exc))
+
+
+class LogSubscriber:
+    """
+    Bounded queue of (record, raw) items of single consumer.
+    raw is record json shared across subscribers, filled when subscriber wants it.
+    Service events have no record, only raw json.
+    On overflow behaves according to policy:
+    drop_oldest - evict oldest queued record
+    drop_newest - discard incoming record
+    disconnect - close subscription, consumer receives None
+    """
+
+    def __init__(self, broker, maxsize=LOGS_QUEUE_SIZE, policy=OVERFLOW_DROP_OLDEST, raw=True):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'unknown overflow policy {policy}')
+        self.broker = broker
+        self.maxsize = maxsize
+        self.policy = policy
+        self.queue = deque()
+        self.dropped = 0
+        self.delivered = 0
+        self.closed = False
+        self.overflowed = False
+        self.filter = None
+        self.raw = raw
+        # batching: flush every batch_ms or batch_size items. 0 - no batching
+        self.batch_ms = 0
+        self.batch_size = LOGS_BATCH_SIZE
+        self._waiter = None
+
+    def accepts(self, record):
+        return self.filter is None or self.filter.match(record)
+
+    def set_filter(self, log_filter):
+        """
+        Replace selection criteria, already queued records filtered too
+        """
+        self.filter = log_filter
+        if log_filter is not None:
+            self.queue = deque(i for i in self.queue
+                               if i[0] is None or log_filter.match(i[0]))
+
+    def put(self, item):
+        if self.closed:
+            return
+        if len(self.queue) >= self.maxsize:
+            self.dropped += 1
+            if self.policy == OVERFLOW_DROP_NEWEST:
+                return
+            if self.policy == OVERFLOW_DISCONNECT:
+                self.overflowed = True
+                self.close()
+                return
+            self.queue.popleft()
+        self.queue.append(item)
+        self._wakeup()
+
+    def replay(self, records):
+        """
+        Queue history records ahead of live ones, already queued duplicates skipped.
+        Only newest records fitting maxsize are kept, the rest counted as dropped
+        """
+        if not records:
+            return
+        last_id = records[-1].id
+        live = [i for i in self.queue if i[0] is None or i[0].id > last_id]
+        room = max(0, self.maxsize - len(live))
+        if len(records) > room:
+            self.dropped += len(records) - room
+            records = records[len(records) - room:]
+        self.queue = deque((r, record_json(r) if self.raw else None) for r in records)
+        self.queue.extend(live)
+        self._wakeup()
+
+    async def get(self):
+        """
+        Next record or None when subscription closed
+        """
+        while not self.queue:
+            if self.closed:
+                return None
+            self._waiter = asyncio.get_event_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        self.delivered += 1
+        return self.queue.popleft()
+
+    async def get_batch(self, max_items, timeout):
+        """
+        Wait for first item then collect more during timeout seconds, up to max_items.
+        Returns None when subscription closed
+        """
+        first = await self.get()
+        if first is None:
+            return None
+        batch = [first]
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while len(batch) < max_items:
+            if self.queue:
+                batch.append(self.queue.popleft())
+                self.delivered += 1
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0 or self.closed:
+                break
+            self._waiter = loop.create_future()
+            try:
+                await asyncio.wait((self._waiter,), timeout=remaining)
+            finally:
+                self._waiter = None
+        return batch
+
+    def _wakeup(self):
+        if self._waiter and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.broker.unsubscribe(self)
+        self._wakeup()
+        if self.dropped:
+            logger.info('logs subscriber closed with drops',
+                        dropped=self.dropped, delivered=self.delivered, policy=self.policy)
+
+    def stats(self):
+        return dict(
+            policy=self.policy,
+            maxsize=self.maxsize,
+            queued=len(self.queue),
+            delivered=self.delivered,
+            dropped=self.dropped)
+
+
+class LogBroker:
+    """
+    Fan-out of containers log records to subscribers
+    """
+
+    def __init__(self):
+        self._subs = set()
+
+    def subscribe(self, **kwargs):
+        sub = LogSubscriber(self, **kwargs)
+        self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        self._subs.discard(sub)
+
+    def publish(self, record):
+        raw = None
+        for sub in tuple(self._subs):
+            if sub.accepts(record):
+                if sub.raw and raw is None:
+                    raw = record_json(record)
+                sub.put((record, raw))
+
+    def broadcast(self, raw, name=None):
+        """
+        Push service event json to websocket subscribers watching that service
+        """
+        for sub in tuple(self._subs):
+            if sub.raw and (sub.filter is None or sub.filter.match_name(name)):
+                sub.put((None, raw))
+
+    def stats(self):
+        return [sub.stats() for sub in self._subs]
+
+    def close(self):
+        for sub in tuple(self._subs):
+            sub.close()
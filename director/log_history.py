@@ -0,0 +1,121 @@
+from array import array
+from bisect import bisect_right
+from sys import intern
+
+from .constants import LOGS_HISTORY_SIZE
+from .structs import LogRecord
+
+SOURCES = ('', 'stdin', 'stdout', 'stderr')
+SOURCE_CODES = {s: i for i, s in enumerate(SOURCES)}
+
+
+class _IdsView:
+    """
+    Ring ids in chronological order, for bisect
+    """
+    __slots__ = ('ring',)
+
+    def __init__(self, ring):
+        self.ring = ring
+
+    def __len__(self):
+        return self.ring.count
+
+    def __getitem__(self, i):
+        return self.ring.ids[self.ring.index(i)]
+
+
+class LogRing:
+    """
+    Fixed size log history of single service.
+    Numeric fields kept in typed arrays, container ids interned
+    """
+    __slots__ = ('name', 'size', 'pos', 'count', 'ids', 'tss', 'sizes',
+                 'sources', 'cids', 'messages')
+
+    def __init__(self, name, size=LOGS_HISTORY_SIZE):
+        self.name = intern(name)
+        self.size = size
+        self.pos = 0
+        self.count = 0
+        self.ids = array('q', [0]) * size
+        self.tss = array('q', [0]) * size
+        self.sizes = array('l', [0]) * size
+        self.sources = array('b', [0]) * size
+        self.cids = [None] * size
+        self.messages = [None] * size
+
+    def append(self, rec):
+        i = self.pos
+        self.ids[i] = rec.id
+        self.tss[i] = rec.ts
+        self.sizes[i] = rec.size
+        self.sources[i] = SOURCE_CODES.get(rec.source, 0)
+        self.cids[i] = intern(rec.cid)
+        self.messages[i] = rec.message
+        self.pos = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def index(self, i):
+        """
+        Physical position of i-th record from the oldest one
+        """
+        return (self.pos - self.count + i) % self.size
+
+    def record(self, i):
+        j = self.index(i)
+        return LogRecord(self.ids[j], self.tss[j], self.cids[j], self.name,
+                         SOURCES[self.sources[j]], self.sizes[j], self.messages[j])
+
+    def records(self, since_id=None, until_id=None, last=None):
+        """
+        Records with since_id < id <= until_id, at most `last` newest of them
+        """
+        ids = _IdsView(self)
+        start = bisect_right(ids, since_id) if since_id is not None else 0
+        end = bisect_right(ids, until_id) if until_id is not None else self.count
+        if last is not None:
+            start = max(start, end - last)
+        return [self.record(i) for i in range(start, end)]
+
+    def __len__(self):
+        return self.count
+
+
+class LogHistory:
+    """
+    Per-service logs history
+    """
+
+    def __init__(self, size=LOGS_HISTORY_SIZE):
+        self.size = size
+        self._rings = dict()
+
+    def append(self, rec):
+        ring = self._rings.get(rec.name)
+        if not ring:
+            ring = self._rings[rec.name] = LogRing(rec.name, self.size)
+        ring.append(rec)
+
+    def get(self, name):
+        return self._rings.get(name)
+
+    def select(self, log_filter=None, last=None):
+        """
+        Records of all services matching filter, sorted by id
+        """
+        names = self._rings.keys()
+        if log_filter and log_filter.names:
+            names = log_filter.names
+        since_id = log_filter.since_id if log_filter else None
+        recs = []
+        for name in names:
+            ring = self._rings.get(name)
+            if ring:
+                recs.extend(r for r in ring.records(since_id=since_id)
+                            if not log_filter or log_filter.match(r))
+        recs.sort(key=lambda r: r.id)
+        if last:
+            recs = recs[-last:]
+        return recs
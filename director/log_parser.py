@@ -0,0 +1,81 @@
+"""
+Docker multiplexed logs stream parser.
+Each frame is 8 bytes header [stream, 0, 0, 0, size (4 bytes big endian)] followed by payload.
+https://docs.docker.com/engine/api/v1.37/#operation/ContainerAttach
+"""
+import struct
+
+HEADER = struct.Struct('>BxxxL')
+HEADER_SIZE = HEADER.size
+STREAMS = ('stdin', 'stdout', 'stderr')
+
+
+class LogFrameParser:
+    """
+    Incremental parser, chunks may hold partial or several frames.
+    Unparsed tail kept in reusable buffer, payloads decoded straight from it.
+    Streams of tty containers have no headers, they are split by lines
+    """
+    __slots__ = ('buf', 'raw')
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.raw = False
+
+    def feed(self, chunk):
+        """
+        Returns list of (source, size, message), one item per payload line.
+        size is line length in bytes including newline
+        """
+        buf = self.buf
+        buf += chunk
+        out = []
+        pos = 0
+        end = len(buf)
+        mv = memoryview(buf)
+        try:
+            while not self.raw and end - pos >= HEADER_SIZE:
+                stream, size = HEADER.unpack_from(buf, pos)
+                if stream >= len(STREAMS) or buf[pos + 1] or buf[pos + 2] or buf[pos + 3]:
+                    self.raw = True
+                    break
+                start = pos + HEADER_SIZE
+                if end - start < size:
+                    break
+                pos = start + size
+                self._lines(out, STREAMS[stream], buf, mv, start, pos)
+            if self.raw:
+                nl = buf.rfind(b'\n', pos)
+                if nl >= 0:
+                    self._lines(out, 'stdout', buf, mv, pos, nl + 1)
+                    pos = nl + 1
+        finally:
+            mv.release()
+        if pos:
+            del buf[:pos]
+        return out
+
+    @staticmethod
+    def _lines(out, source, buf, mv, start, end):
+        if start == end:
+            return
+        newline = buf[end - 1] == 10
+        payload = str(mv[start:end - newline], 'utf-8', 'replace')
+        if '\n' not in payload:
+            out.append((source, end - start, payload))
+            return
+        if len(payload) + newline == end - start:
+            # decoded line never longer than its bytes, equal totals mean equal lines
+            lines = payload.split('\n')
+            tail = lines.pop()
+            for line in lines:
+                out.append((source, len(line) + 1, line))
+            out.append((source, len(tail) + newline, tail))
+            return
+        # non-ascii text, sizes counted on raw bytes
+        lines = bytes(mv[start:end]).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            out.append((source, len(line) + 1, line.decode('utf-8', 'replace')))
+        if tail:
+            out.append((source, len(tail), tail.decode('utf-8', 'replace')))
@@ -0,0 +1,89 @@
+import asyncio
+import ujson
+from async_timeout import timeout
+from band import logger, settings
+from simplech import AsyncClickHouse
+
+from .constants import (
+    LOGS_TABLE, LOGS_SHIP_BATCH, LOGS_SHIP_INTERVAL, LOGS_SHIP_BUFFER,
+    LOGS_SHIP_MAX_DELAY, LOGS_SHIP_RETRIES, LOGS_SHIP_TIMEOUT, OVERFLOW_DROP_OLDEST)
+
+ch = AsyncClickHouse()
+
+
+class LogsInsertError(Exception):
+    pass
+
+
+class LogShipper:
+    """
+    Writes containers log records to ClickHouse logs table.
+    Records are batched by size and time, one insert per batch.
+    While ClickHouse is down batch is retried with backoff up to `retries` times
+    then dropped, new records wait in bounded queue, oldest evicted first
+    """
+
+    def __init__(self, broker, batch_size=LOGS_SHIP_BATCH, interval=LOGS_SHIP_INTERVAL,
+                 buffer_size=LOGS_SHIP_BUFFER, retries=LOGS_SHIP_RETRIES, table=None):
+        self.broker = broker
+        self.batch_size = batch_size
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self.retries = retries
+        self.table = table or settings.get('logs_table', LOGS_TABLE)
+        self.subscription = None
+        self.shipped = 0
+        self.failures = 0
+        # records of batches given up after retries
+        self.rejected = 0
+
+    async def run(self):
+        self.subscription = self.broker.subscribe(
+            maxsize=self.buffer_size, policy=OVERFLOW_DROP_OLDEST, raw=False)
+        try:
+            while True:
+                items = await self.subscription.get_batch(self.batch_size, self.interval)
+                if items is None:
+                    break
+                await self.send([rec for rec, _ in items])
+        finally:
+            self.subscription.close()
+
+    async def send(self, batch):
+        delay = 1
+        for attempt in range(self.retries + 1):
+            try:
+                await self.insert(batch)
+                self.shipped += len(batch)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.failures += 1
+                if attempt == self.retries:
+                    break
+                logger.warn('logs shipping failed, retrying', size=len(batch), delay=delay,
+                            error=str(exc), dropped=self.subscription.dropped)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LOGS_SHIP_MAX_DELAY)
+        self.rejected += len(batch)
+        logger.error('logs batch dropped after retries', size=len(batch), retries=self.retries)
+
+    async def insert(self, batch):
+        body = '\n'.join(ujson.dumps(rec._asdict(), ensure_ascii=False) for rec in batch)
+        query = f'INSERT INTO {self.table} FORMAT JSONEachRow'
+        async with timeout(LOGS_SHIP_TIMEOUT):
+            async with ch.conn_class() as session:
+                async with ch._make_request(
+                        query, session, body=body.encode(), method='POST') as response:
+                    if response.status != 200:
+                        text = await response.text()
+                        raise LogsInsertError(f'ClickHouse HTTP {response.status}: {text[:500]}')
+
+    def stats(self):
+        overflow = self.subscription.dropped if self.subscription else 0
+        return dict(
+            shipped=self.shipped,
+            failures=self.failures,
+            rejected=self.rejected,
+            dropped=overflow + self.rejected)
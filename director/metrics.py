@@ -0,0 +1,96 @@
+from array import array
+from time import time
+
+from .constants import STATS_WINDOW, STATS_MAX_GAP
+
+
+def cpu_percent(sample):
+    """
+    CPU usage percent the same way docker cli calculates it
+    """
+    cpu = sample.get('cpu_stats') or {}
+    pre = sample.get('precpu_stats') or {}
+    if not pre.get('system_cpu_usage'):
+        return None
+    cpu_delta = cpu['cpu_usage']['total_usage'] - pre['cpu_usage']['total_usage']
+    system_delta = cpu.get('system_cpu_usage', 0) - pre['system_cpu_usage']
+    if cpu_delta < 0 or system_delta <= 0:
+        return 0.0
+    ncpu = cpu.get('online_cpus') or len(cpu['cpu_usage'].get('percpu_usage') or ()) or 1
+    return cpu_delta / system_delta * ncpu * 100
+
+
+def mem_usage(sample):
+    """
+    Memory usage without page cache and memory limit in bytes
+    """
+    mem = sample.get('memory_stats') or {}
+    usage = mem.get('usage')
+    if usage is None:
+        return None, None
+    stats = mem.get('stats') or {}
+    usage -= stats.get('inactive_file', stats.get('cache', 0))
+    return max(usage, 0), mem.get('limit') or 0
+
+
+class ServiceMetrics:
+    """
+    Container metrics of single service.
+    Samples stored in preallocated ring buffers, last values available in O(1)
+    """
+    __slots__ = ('size', 'pos', 'count', 'cpu', 'mem', 'mem_bytes', 'mem_limit',
+                 'first_ts', 'last_ts', 'up_total')
+
+    def __init__(self, size=STATS_WINDOW):
+        self.size = size
+        self.pos = 0
+        self.count = 0
+        # cpu usage percent
+        self.cpu = array('f', [0.0]) * size
+        # memory usage percent of limit
+        self.mem = array('f', [0.0]) * size
+        self.mem_bytes = 0
+        self.mem_limit = 0
+        # sla accounting
+        self.first_ts = time()
+        self.last_ts = None
+        self.up_total = 0.0
+
+    def push(self, sample):
+        now = time()
+        if self.last_ts:
+            # gaps longer than expected stream interval counted as downtime
+            self.up_total += min(now - self.last_ts, STATS_MAX_GAP)
+        self.last_ts = now
+
+        cpu = cpu_percent(sample)
+        usage, limit = mem_usage(sample)
+        if cpu is None or usage is None:
+            return
+        self.mem_bytes = usage
+        self.mem_limit = limit
+        self.cpu[self.pos] = cpu
+        self.mem[self.pos] = usage / limit * 100 if limit else 0.0
+        self.pos = (self.pos + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def stream_closed(self):
+        self.last_ts = None
+
+    def last(self, buff):
+        if self.count:
+            return buff[self.pos - 1]
+        return 0.0
+
+    @property
+    def sla(self):
+        observed = time() - self.first_ts
+        if observed <= 0:
+            return 0.0
+        return min(self.up_total / observed * 100, 100.0)
+
+    def summary(self):
+        return dict(
+            sla=round(self.sla, 2),
+            mem=round(self.last(self.mem), 2),
+            cpu=round(self.last(self.cpu), 2))
@@ -0,0 +1,178 @@
+from time import time
+
+
+class PortsExhausted(Exception):
+    pass
+
+
+class PortAllocator:
+    """
+    Host ports pool of services.
+    Ports are owned by service name and bound to container id once container created.
+    Binding protects fresh allocation from events of service's previous container
+    """
+
+    def __init__(self, start_port, end_port):
+        self.pool = range(start_port, end_port)
+        self._free = set(self.pool)
+        # name -> allocated ports
+        self._owners = dict()
+        # name -> container id, None while container not created yet
+        self._cids = dict()
+        # name -> allocation time of pending reservations
+        self._pending_ts = dict()
+        # names changed since last persist
+        self.dirty = set()
+        # (name, id) bound but missing at last seed, dropped when missing again
+        self._unlisted = set()
+
+    def _take(self, name, ports, cid=None, ts=None):
+        ports = list(ports)
+        self._free.difference_update(ports)
+        self._owners[name] = ports
+        self._cids[name] = cid
+        if cid is None:
+            self._pending_ts[name] = ts or time()
+        else:
+            self._pending_ts.pop(name, None)
+        self.dirty.add(name)
+
+    def _drop(self, name):
+        ports = self._owners.pop(name, None)
+        self._cids.pop(name, None)
+        self._pending_ts.pop(name, None)
+        if ports:
+            self._free.update(p for p in ports if p in self.pool)
+        self.dirty.add(name)
+        return ports
+
+    def seed(self, containers, reserved=None):
+        """
+        Rebuild pool from containers (name, id, ports).
+        Pending allocations, allocations bound to container not listed yet
+        and restored reservations kept unless service container exists.
+        Bound allocation missing on two seeds in a row belongs to removed container
+        """
+        containers = list(containers)
+        listed = {cid for _, cid, _ in containers}
+        unlisted = {(name, cid) for name, cid in self._cids.items()
+                    if cid is not None and cid not in listed}
+        kept = {name: (self._owners[name], cid, self._pending_ts.get(name))
+                for name, cid in self._cids.items()
+                if cid not in listed and (name, cid) not in self._unlisted}
+        self._unlisted = unlisted
+        for name, (ports, ts) in (reserved or {}).items():
+            kept[name] = (ports, None, ts)
+        prev = set(self._owners)
+        self._free = set(self.pool)
+        self._owners = dict()
+        self._cids = dict()
+        self._pending_ts = dict()
+        for name, cid, ports in containers:
+            self._take(name, ports, cid)
+        for name, (ports, cid, ts) in kept.items():
+            if name not in self._owners:
+                self._take(name, (p for p in ports if p in self._free), cid, ts)
+        self.dirty.update(prev - set(self._owners))
+
+    def allocate(self, name, count):
+        """
+        Reserve `count` ports for service. Service keeps previous ports when possible
+        """
+        prev = self._owners.get(name)
+        if prev is not None and len(prev) == count:
+            self._take(name, prev)
+            return list(prev)
+        if prev is not None:
+            self._drop(name)
+        if len(self._free) < count:
+            raise PortsExhausted(f'no free ports for {name}: {count} requested, {len(self._free)} available')
+        ports = [self._free.pop() for _ in range(count)]
+        self._take(name, ports)
+        return ports
+
+    def bind(self, name, cid):
+        if name in self._owners:
+            self._cids[name] = cid
+            self._pending_ts.pop(name, None)
+            self.dirty.add(name)
+
+    def observe(self, name, cid, ports, live=()):
+        """
+        Sync with actual container state.
+        While allocation pending, only container holding allocated ports binds it.
+        Bound allocation follows only its container while it is in `live` ids,
+        late events of replaced container ignored
+        """
+        ports = list(ports)
+        owned = self._owners.get(name)
+        bound = self._cids.get(name)
+        if bound == cid and owned == ports:
+            return
+        if bound is not None and bound != cid and bound in live:
+            return
+        if name in self._pending_ts:
+            if sorted(owned) == sorted(ports):
+                self.bind(name, cid)
+            return
+        if owned is not None:
+            self._drop(name)
+        self._take(name, ports, cid)
+
+    def release(self, name, cid=None):
+        """
+        Return service ports to pool. With cid given only when still bound to that container
+        """
+        if name not in self._owners:
+            return None
+        if cid is not None and self._cids.get(name) != cid:
+            return None
+        return self._drop(name)
+
+    def rename(self, name, new_name):
+        """
+        Move allocation to another owner, used when container renamed
+        """
+        if name not in self._owners:
+            return
+        ports = self._owners.pop(name)
+        # target may be already taken by rename event
+        stale = self._owners.pop(new_name, None) or ()
+        self._cids.pop(new_name, None)
+        self._pending_ts.pop(new_name, None)
+        self._free.update(p for p in stale if p in self.pool and p not in ports)
+        self._owners[new_name] = ports
+        self._cids[new_name] = self._cids.pop(name)
+        if name in self._pending_ts:
+            self._pending_ts[new_name] = self._pending_ts.pop(name)
+        self.dirty.update((name, new_name))
+
+    def expire(self, ttl):
+        """
+        Release pending reservations older than ttl seconds
+        """
+        deadline = time() - ttl
+        for name, ts in list(self._pending_ts.items()):
+            if ts < deadline:
+                self._drop(name)
+
+    def pending(self, name):
+        return name in self._pending_ts
+
+    def reservation(self, name):
+        if name in self._owners:
+            return dict(ports=self._owners[name], cid=self._cids[name], ts=self._pending_ts.get(name))
+
+    def take_dirty(self):
+        dirty, self.dirty = self.dirty, set()
+        return {name: self.reservation(name) for name in dirty}
+
+    @property
+    def available(self):
+        return len(self._free)
+
+    def stats(self):
+        return dict(
+            available=self.available,
+            allocated={name: ports for name, ports in self._owners.items()},
+            pending=list(self._pending_ts))
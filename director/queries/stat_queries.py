@@ -1,70 +1,105 @@
+from time import time
+
 FMT_JSON = ' FORMAT JSON'
 FMT_JSON_ROW = ' FORMAT JSONEachRow'
 
-def events_where():
-    return """
-        date >= today() -1
-        AND timestamp > toUInt64(now() - 86400) * 1000
+# groups() result columns
+GROUPS = ('sources', 'newusers', 'devices')
+
+
+def events_where(since=None, until=None):
+    """
+    Events in [since, until) unix ts, last 24h by default.
+    Date condition lets ClickHouse skip whole partitions
+    """
+    if since is None:
+        since = time() - 86400
+    since = int(since)
+    where = f"""
+        date >= toDate({since})
+        AND timestamp >= {since} * 1000
+    """
+    if until is not None:
+        until = int(until)
+        where += f"""
+        AND date <= toDate({until})
+        AND timestamp < {until} * 1000
     """
+    return where
 
 
-def groups(where):
-    return """
-    SELECT param as name, groupArray((n, v)) as data FROM (
-        SELECT
-            'sources' as param,
-            sess_type as n,
-            uniq(uid) AS v
-        FROM events
-        WHERE
-            events.name = 'session'
-            AND {where}
-        GROUP BY n
-        ORDER BY v desc
+def sample_clause(sample=None):
+    return f'SAMPLE {sample}' if sample else ''
 
-    UNION ALL
 
-        SELECT
-            'newusers' as param,
-            if(sess_num == 1, 'new users', 'returning users') as n,
-            uniq(uid) AS v
-        FROM events
-        WHERE
-            events.name = 'session'
-            AND {where}
-        GROUP BY n
-        ORDER BY v desc
+def scaled(expr, sample=None):
+    """
+    Restore sampled aggregate to whole data estimation
+    """
+    return f'round({expr} / {sample})' if sample else expr
 
-    UNION ALL
 
+def groups(where, sample=None):
+    """
+    Sessions users by source, new/returning and device in single pass over events.
+    Returns one row with column per group, each is array of (name, users)
+    """
+    return f"""
+    SELECT
+        arrayReverseSort(x -> x.2, groupArray((sess_type, src))) AS sources,
+        [
+            ('new users', {scaled('uniqMerge(new_u)', sample)}),
+            ('returning users', {scaled('uniqMerge(ret_u)', sample)})
+        ] AS newusers,
+        [
+            ('smartphone', {scaled('uniqMerge(mob_u)', sample)}),
+            ('tablet', {scaled('uniqMerge(tab_u)', sample)}),
+            ('desktop', {scaled('uniqMerge(pc_u)', sample)}),
+            ('other', {scaled('uniqMerge(oth_u)', sample)})
+        ] AS devices
+    FROM (
         SELECT
-            'devices' as param,            
-            CASE
-                WHEN uaparser_is_mob == 1 THEN 'smartphone'
-                WHEN uaparser_is_tablet == 1  THEN 'tablet'
-                WHEN uaparser_is_pc == 1  THEN 'desktop'
-                ELSE 'other'
-            END as n,
-            uniq(uid) AS v
-        FROM events
+            sess_type,
+            {scaled('uniq(uid)', sample)} AS src,
+            uniqIfState(uid, sess_num == 1) AS new_u,
+            uniqIfState(uid, sess_num != 1) AS ret_u,
+            uniqIfState(uid, uaparser_is_mob == 1) AS mob_u,
+            uniqIfState(uid, uaparser_is_mob != 1 AND uaparser_is_tablet == 1) AS tab_u,
+            uniqIfState(uid, uaparser_is_mob != 1 AND uaparser_is_tablet != 1
+                        AND uaparser_is_pc == 1) AS pc_u,
+            uniqIfState(uid, uaparser_is_mob != 1 AND uaparser_is_tablet != 1
+                        AND uaparser_is_pc != 1) AS oth_u
+        FROM events {sample_clause(sample)}
         WHERE
             events.name = 'session'
             AND {where}
-        GROUP BY n, uaparser_is_mob, uaparser_is_tablet, uaparser_is_pc
-        ORDER BY v desc
+        GROUP BY sess_type
     )
-    GROUP BY param
-    """.format(where=where)
+    """
+
+
+def groups_data(rows):
+    """
+    groups() row to list of {name, data}, empty values skipped, biggest first
+    """
+    res = []
+    for row in rows:
+        for param in GROUPS:
+            data = [item for item in row.get(param) or () if int(item[1])]
+            data.sort(key=lambda item: int(item[1]), reverse=True)
+            if data:
+                res.append(dict(name=param, data=data))
+    return res
 
 
-def events(where, step=900):
+def events(where, step=900, sample=None):
     return f"""
         SELECT name, groupArray((t, v)) as data FROM (
             SELECT
                 events.name,
-                intDiv(toUInt32(dateTime), {step}) * {step} as t,
-                count() AS v
-            FROM events
+                intDiv(toUInt32(dateTime), {int(step)}) * {int(step)} as t,
+                {scaled('count()', sample)} AS v
+            FROM events {sample_clause(sample)}
             WHERE
                 {where}
             GROUP BY events.name, t
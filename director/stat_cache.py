@@ -0,0 +1,100 @@
+import asyncio
+from time import time
+
+from band import logger, scheduler
+
+from .constants import STAT_TTL, STAT_MAX_STALE, STAT_WAIT, STAT_KEYS_KEEP
+
+
+class CachedValue:
+    """
+    Query result kept in memory.
+    Fresh during ttl, then served stale while single background refresh runs.
+    Concurrent callers share one in-flight load
+    """
+    __slots__ = ('key', 'loader', 'value', 'ts', 'used', 'inflight')
+
+    def __init__(self, key, loader):
+        self.key = key
+        self.loader = loader
+        self.value = None
+        self.ts = 0
+        self.used = 0
+        self.inflight = None
+
+    def refresh(self):
+        """
+        Start load as band job unless running, returns future resolved with value
+        """
+        if not self.inflight:
+            self.inflight = asyncio.get_event_loop().create_future()
+            asyncio.ensure_future(scheduler.spawn(self._load()))
+        return self.inflight
+
+    async def _load(self):
+        try:
+            self.value = await self.loader()
+            self.ts = time()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('stat load error', key=self.key)
+        finally:
+            inflight, self.inflight = self.inflight, None
+            if not inflight.done():
+                inflight.set_result(self.value)
+        return self.value
+
+
+class StatCache:
+    """
+    Stats results by key, loaded with single-flight and stale-while-revalidate
+    """
+
+    def __init__(self, ttl=STAT_TTL, max_stale=STAT_MAX_STALE, wait=STAT_WAIT,
+                 keep=STAT_KEYS_KEEP):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.wait = wait
+        self.keep = keep
+        self._items = dict()
+
+    async def get(self, key, loader, default=None):
+        """
+        Cached value of key. Loader is coroutine function, called when value expired.
+        Returns default when no value loaded (failed or not in `wait` seconds),
+        slow load continues in background
+        """
+        item = self._items.get(key)
+        if not item:
+            item = self._items[key] = CachedValue(key, loader)
+            self._evict()
+        item.loader = loader
+        now = item.used = time()
+        age = now - item.ts
+        if item.ts and age < self.ttl:
+            value = item.value
+        elif item.ts and age < self.max_stale:
+            item.refresh()
+            value = item.value
+        else:
+            try:
+                value = await asyncio.wait_for(asyncio.shield(item.refresh()), self.wait)
+            except asyncio.TimeoutError:
+                logger.warn('stat load is slow, serving default', key=key)
+                value = item.value
+        return value if value is not None else default
+
+    def _evict(self):
+        if len(self._items) <= self.keep:
+            return
+        victim = min((i for i in self._items.values() if not i.inflight),
+                     key=lambda i: i.used, default=None)
+        if victim:
+            del self._items[victim.key]
+
+    def stats(self):
+        now = time()
+        return {str(k): dict(age=round(now - i.ts, 1) if i.ts else None,
+                             loading=bool(i.inflight))
+                for k, i in self._items.items()}
@@ -0,0 +1,80 @@
+from time import time
+
+from .constants import STAT_STEP, STAT_WINDOW, STAT_FULL_INTERVAL
+
+
+class EventsRollup:
+    """
+    Events counts per name in `step` buckets over `window` seconds.
+    Refresh queries only buckets since the one open at previous refresh,
+    full recompute every `full_interval` picks up late rows
+    """
+
+    def __init__(self, step=STAT_STEP, window=STAT_WINDOW, full_interval=STAT_FULL_INTERVAL,
+                 sample=None):
+        self.step = step
+        self.window = window
+        self.sample = sample
+        self.full_interval = full_interval
+        # name -> {bucket ts: (t, v) as returned by ClickHouse}
+        self.series = dict()
+        # start of bucket open at last refresh, None - no data yet
+        self.open_bucket = None
+        self.full_ts = 0
+
+    def bucket(self, ts):
+        return int(ts) // self.step * self.step
+
+    async def refresh(self, select, queries):
+        """
+        select - coroutine function (query, row handler), streams rows of queries.events
+        """
+        now = time()
+        full = self.open_bucket is None or now - self.full_ts >= self.full_interval
+        since = None if full else self.open_bucket
+        query = queries.events(
+            queries.events_where(now - self.window if full else since),
+            step=self.step, sample=self.sample)
+        self.begin(since)
+        try:
+            await select(query, self.add)
+        except BaseException:
+            # series partially replaced, next refresh recomputes whole window
+            self.open_bucket = None
+            raise
+        if full:
+            self.full_ts = now
+        self.open_bucket = self.bucket(now)
+        self.trim(now)
+        return self.data()
+
+    def begin(self, since):
+        """
+        Drop buckets starting from `since` before fresh rows added, all when since is None
+        """
+        if since is None:
+            self.series = dict()
+            return
+        for buckets in self.series.values():
+            for t in [t for t in buckets if t >= since]:
+                del buckets[t]
+
+    def add(self, row):
+        buckets = self.series.setdefault(row['name'], dict())
+        for item in row['data']:
+            buckets[int(item[0])] = item
+
+    def trim(self, now):
+        oldest = now - self.window
+        for name in list(self.series):
+            buckets = self.series[name]
+            for t in [t for t in buckets if t + self.step <= oldest]:
+                del buckets[t]
+            if not buckets:
+                del self.series[name]
+
+    def data(self):
+        res = [dict(name=name, data=[buckets[t] for t in sorted(buckets)])
+               for name, buckets in self.series.items()]
+        res.sort(key=lambda r: len(r['data']), reverse=True)
+        return res
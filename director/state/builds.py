@@ -0,0 +1,111 @@
+import asyncio
+import os
+from collections import OrderedDict, defaultdict
+from itertools import count
+from time import time
+from prodict import Prodict as pdict
+
+from band import logger, scheduler
+
+from ..constants import (
+    BUILD_MEM_PER_JOB, BUILD_JOBS_KEEP, BUILD_QUEUED, BUILD_WAITING_BASE,
+    BUILD_RUNNING, BUILD_DONE, BUILD_FAILED)
+
+
+def default_concurrency():
+    """
+    Simultaneous builds fitting host CPUs and memory
+    """
+    cpus = os.cpu_count() or 1
+    try:
+        mem = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return max(1, cpus // 2)
+    return max(1, min(cpus, mem // BUILD_MEM_PER_JOB))
+
+
+class BuildJob:
+    def __init__(self, job_id, names):
+        self.id = job_id
+        self.created = time()
+        self.services = OrderedDict(
+            (name, pdict(state=BUILD_QUEUED, base=None, started=None, finished=None, error=None))
+            for name in names)
+        self.done = asyncio.Event()
+
+    def set_state(self, name, state, **kwargs):
+        svc = self.services[name]
+        svc.state = state
+        svc.update(kwargs)
+
+    @property
+    def finished(self):
+        return self.done.is_set()
+
+    def progress(self):
+        return dict(
+            id=self.id,
+            created=self.created,
+            finished=self.finished,
+            services=self.services)
+
+
+class BuildScheduler:
+    """
+    Runs services build/run jobs, at most `concurrency` services at once.
+    Services sharing base image start after first of them warmed base layers,
+    services with different bases go in parallel
+    """
+
+    def __init__(self, manager, concurrency=None):
+        self.manager = manager
+        self.concurrency = concurrency or default_concurrency()
+        self._sem = None
+        self._ids = count(1)
+        self.jobs = OrderedDict()
+
+    async def submit(self, names):
+        job = BuildJob(next(self._ids), names)
+        self.jobs[job.id] = job
+        while len(self.jobs) > BUILD_JOBS_KEEP:
+            self.jobs.popitem(last=False)
+        await scheduler.spawn(self._run_job(job))
+        logger.info('build job submitted', job_id=job.id, services=names, concurrency=self.concurrency)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def _run_job(self, job):
+        if not self._sem:
+            self._sem = asyncio.Semaphore(self.concurrency)
+        groups = defaultdict(list)
+        for name in job.services:
+            base = self.manager.image_base(name)
+            job.services[name].base = base
+            groups[base].append(name)
+        try:
+            await asyncio.gather(*(self._run_group(job, names) for names in groups.values()))
+        finally:
+            job.done.set()
+            logger.info('build job finished', job_id=job.id)
+
+    async def _run_group(self, job, names):
+        first, rest = names[0], names[1:]
+        for name in rest:
+            job.set_state(name, BUILD_WAITING_BASE)
+        await self._run_service(job, first)
+        await asyncio.gather(*(self._run_service(job, name) for name in rest))
+
+    async def _run_service(self, job, name):
+        async with self._sem:
+            job.set_state(name, BUILD_RUNNING, started=time())
+            try:
+                await self.manager.run_service(name)
+                job.set_state(name, BUILD_DONE, finished=time())
+            except asyncio.CancelledError:
+                job.set_state(name, BUILD_FAILED, finished=time(), error='cancelled')
+                raise
+            except Exception as exc:
+                logger.exception('service build failed', name=name, job_id=job.id)
+                job.set_state(name, BUILD_FAILED, finished=time(), error=str(exc))
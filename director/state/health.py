@@ -0,0 +1,140 @@
+import asyncio
+from array import array
+from bisect import bisect_left
+from time import time
+
+from band import logger
+
+from ..constants import (
+    HEALTH_INTERVAL, HEALTH_DEADLINE, HEALTH_MAX_BACKOFF, HEALTH_BUCKETS)
+
+
+class LatencyHistogram:
+    """
+    RPC latency distribution, ms. Last bucket collects everything above HEALTH_BUCKETS
+    """
+    __slots__ = ('bounds', 'counts', 'total', 'sum')
+
+    def __init__(self, bounds=HEALTH_BUCKETS):
+        self.bounds = bounds
+        self.counts = array('L', [0]) * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect_left(self.bounds, ms)] += 1
+        self.total += 1
+        self.sum += ms
+
+    def quantile(self, q):
+        """
+        Upper bound of bucket holding q-quantile
+        """
+        if not self.total:
+            return None
+        rank = q * self.total
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                return self.bounds[i] if i < len(self.bounds) else None
+        return None
+
+    def as_dict(self):
+        return dict(
+            count=self.total,
+            avg=round(self.sum / self.total, 1) if self.total else None,
+            p50=self.quantile(0.5),
+            p95=self.quantile(0.95),
+            buckets=dict(zip(map(str, self.bounds + ('inf',)), self.counts)))
+
+
+class ServiceHealth:
+    __slots__ = ('latency', 'failures', 'next_poll', 'last_ok', 'last_error')
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.failures = 0
+        self.next_poll = 0
+        self.last_ok = None
+        self.last_error = None
+
+    def as_dict(self):
+        return dict(
+            latency=self.latency.as_dict(),
+            failures=self.failures,
+            next_poll=self.next_poll,
+            last_ok=self.last_ok,
+            last_error=self.last_error)
+
+
+class HealthPoller:
+    """
+    Periodic app state requests to all native services at once.
+    Round is bounded by deadline, services not replied in time backed off exponentially
+    """
+
+    def __init__(self, manager, interval=HEALTH_INTERVAL, deadline=HEALTH_DEADLINE,
+                 max_backoff=HEALTH_MAX_BACKOFF):
+        self.manager = manager
+        self.interval = interval
+        self.deadline = deadline
+        self.max_backoff = max_backoff
+        self.services = dict()
+
+    def health(self, name):
+        h = self.services.get(name)
+        if not h:
+            h = self.services[name] = ServiceHealth()
+        return h
+
+    async def run(self):
+        while True:
+            try:
+                await self.poll_all()
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                logger.exception('health poller')
+                await asyncio.sleep(self.interval)
+
+    async def poll_all(self):
+        now = time()
+        targets = set(self.manager.health_targets())
+        for name in set(self.services) - targets:
+            del self.services[name]
+        names = [name for name in targets if self.health(name).next_poll <= now]
+        if not names:
+            return
+        tasks = {asyncio.ensure_future(self.poll(name)): name for name in names}
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+            self.failed(tasks[task], 'deadline exceeded')
+        for task in done:
+            if not task.cancelled() and task.exception():
+                self.failed(tasks[task], str(task.exception()))
+
+    async def poll(self, name):
+        start = time()
+        status = await self.manager.request_app_state(name)
+        if not status:
+            raise Exception('no status reply')
+        h = self.health(name)
+        h.latency.observe((time() - start) * 1000)
+        h.failures = 0
+        h.last_ok = time()
+        h.last_error = None
+        h.next_poll = 0
+
+    def failed(self, name, error):
+        h = self.health(name)
+        h.failures += 1
+        h.last_error = error
+        h.next_poll = time() + min(self.interval * 2 ** h.failures, self.max_backoff)
+        if h.failures == 1:
+            logger.warn('service status request failed', name=name, error=error)
+
+    def stats(self):
+        return {name: h.as_dict() for name, h in self.services.items()}
@@ -3,6 +3,7 @@ import ujson
 from prodict import Prodict as pdict
 from itertools import count
 from copy import deepcopy
+from time import time
 from typing import Coroutine
 from band import logger, settings, rpc, app, scheduler
 from band.constants import (
@@ -12,19 +13,26 @@ from band.constants import (
 from ..helpers import nn, merge_dicts
 from ..band_config import BandConfig
 from ..constants import (
-    STARTED_SET, SERVICE_TIMEOUT, DEFAULT_COL, DEFAULT_ROW,
+    STARTED_SET, SERVICE_TIMEOUT, STATUS_RUNNING, DEFAULT_COL, DEFAULT_ROW,
     STATUS_RESTARTING, STATUS_REMOVING, STATUS_STARTING,
-    STATUS_STOPPING, SHARED_CONFIG_KEY)
+    STATUS_STOPPING, SHARED_CONFIG_KEY,
+    OP_RUN, OP_STOP, OP_START, OP_REMOVE, OP_RESTART,
+    BLUE_GREEN_READY_TIMEOUT, BLUE_GREEN_POLL)
 
-from ..docker_manager import DockerManager
+from ..docker_manager import DockerManager, is_transient
+from ..build_context import dockerfile_base
 from .context import StateCtx
 from .service import ServiceState
 from ..image_navigator import ImageNavigator
 from .grid import is_valid_pos, ServicesGrid
+from .builds import BuildScheduler
+from .ops import OperationsQueue
+from .registrations import RegistrationsIndex
+from .health import HealthPoller
 
 image_navigator = ImageNavigator(**settings)
 band_config = BandConfig(**settings)
-dock = DockerManager(image_navigator=image_navigator, **settings)
+dock = DockerManager(image_navigator=image_navigator, band_config=band_config, **settings)
 
 
 class StateManager:
@@ -32,8 +40,18 @@ class StateManager:
         self.timeout = 30
         self._state = dict()
         self._shared_config = dict()
-        self.registrations_hash = ''
+        # services configs loaded at startup and kept in sync on save, None - not loaded
+        self._configs = None
+        # active services methods, versioned
+        self.regs = RegistrationsIndex()
+        # registrations version frontier confirmed, None - full set required
+        self.frontier_regs_version = None
+        # services app state polling
+        self.health = HealthPoller(self)
         self.grid = ServicesGrid(self)
+        self.builds = BuildScheduler(self, concurrency=settings.get('build_concurrency'))
+        # serialized per-service operations
+        self.ops = OperationsQueue()
 
     """
     Lifecycle functions
@@ -42,20 +60,22 @@ class StateManager:
     async def initialize(self):
         await band_config.initialize()
         await image_navigator.load()
-        await self.load_config(SHARED_CONFIG_KEY)
-        await self.resolve_docstatus_all()
+        # all configs and started set at once instead of request per service
+        snapshot = await band_config.load_all(STARTED_SET)
+        self._configs = snapshot.configs
+        if self._configs.get(SHARED_CONFIG_KEY):
+            self._shared_config = self._configs[SHARED_CONFIG_KEY]
         await dock.initialize()
+        await self.resolve_docstatus_all()
 
         # initial fill autostart 
-        started_present = await band_config.set_exists(STARTED_SET)
-        if not started_present:
+        started = snapshot.sets[STARTED_SET]
+        if not snapshot.exists[STARTED_SET]:
+            started = set(settings.initial_startup)
             await band_config.set_add(STARTED_SET, *settings.initial_startup)
 
-        # looking for containers to request status
-        for container in await dock.containers():
-            if container.running and container.native:
-                await scheduler.spawn(
-                    self.request_app_state(container.name))
+        # requesting status of running containers, first round starts immediately
+        await scheduler.spawn(self.health.run())
         
         # spawning state cleaner job
         await scheduler.spawn(self.clean_worker())
@@ -63,7 +83,7 @@ class StateManager:
         await scheduler.spawn(self.images_loader())
 
         # handling autostart
-        await self.handle_auto_start()
+        await self.handle_auto_start(started)
 
     async def images_loader(self):
         while True:
@@ -89,15 +109,18 @@ class StateManager:
                 logger.exception('state initialize')
             await asyncio.sleep(1)
 
-    async def handle_auto_start(self):
-        services = await self.should_start()
+    async def handle_auto_start(self, services=None):
+        if services is None:
+            services = await self.should_start()
         logger.info("Autostarting services", items=services)
+        names = []
         for item in services:
             svc = await self.get(item)
             if not svc.is_active() and image_navigator.is_native(svc.name):
-                await self.run_service(svc.name)
-            # if not (item in state and ().is_active()):
-            # asyncio.ensure_future(run(item))
+                names.append(svc.name)
+        if names:
+            job = await self.build_services(names)
+            await job.done.wait()
 
     async def unload(self):
         await band_config.unload()
@@ -141,7 +164,7 @@ class StateManager:
 
         if name not in self._state:
             logger.debug('loading state', name=name)
-            config = await self.load_config(name)
+            config = await self.cached_config(name)
             meta = await image_navigator.image_meta(name)
             svc = ServiceState(name=name, manager=self)
 
@@ -180,33 +203,95 @@ class StateManager:
 
         return svc
 
-    def logs_reader(self):
-        return dock.get_log_reader()
+    def logs_reader(self, **kwargs):
+        return dock.get_log_reader(**kwargs)
+
+    def logs_history(self, log_filter=None, last=None):
+        return dock.log_history.select(log_filter, last=last)
 
     async def run_service(self, name, no_wait=False):
         svc = await self.get(name)
         svc.clean_status()
         svc.set_status_override(STATUS_STARTING)
-        coro = self._do_run_service(name)
-        await (scheduler.spawn(coro) if no_wait else coro)
+        await self.enqueue(name, OP_RUN, self._do_run_service, no_wait)
         return svc
 
+    async def enqueue(self, name, kind, func, no_wait=False):
+        """
+        Put service operation to it's queue, wait for completion unless no_wait
+        """
+        future = self.ops.submit(name, kind, lambda: func(name))
+        if not no_wait:
+            await future
+
     async def _do_run_service(self, name):
         svc = await self.get(name)
         env = deepcopy(self._shared_config.get('env', {}))
         env.update(svc.env)
-        await dock.run_container(name, env=env, **svc.build_options)
+        if svc.build_options.get('blue_green') and svc.is_active():
+            await self._blue_green_deploy(svc, env)
+        else:
+            await dock.run_container(name, env=env, **svc.build_options)
         await band_config.set_add(STARTED_SET, name)
         logger.debug('service. saving config', svc=dict(bo=svc.build_options, e=svc.env))
         svc.save_config()
         await self.resolve_docstatus(name)
 
+    async def _blue_green_deploy(self, svc, env):
+        """
+        Start new container next to running one, swap them once new replies to status request
+        """
+        name = svc.name
+        candidate, timer = await dock.run_candidate(name, env=env, **svc.build_options)
+        try:
+            with timer.phase('ready'):
+                status = await self.wait_app_ready(candidate.name)
+        except (Exception, asyncio.CancelledError):
+            logger.warn('blue/green candidate not ready, keeping current', name=name)
+            await dock.remove_container(candidate.name)
+            raise
+        with timer.phase('swap'):
+            retired = await dock.promote(name, candidate)
+            svc.set_appstate(status)
+            await self.resolve_docstatus(name)
+            await self.check_regs_changed()
+        if retired:
+            with timer.phase('retire'):
+                await dock.remove_container(retired.name)
+        dock.deploy_timings[name] = timer.summary()
+        logger.info('blue/green deploy finished', name=name, timings=dock.deploy_timings[name])
+
+    async def wait_app_ready(self, name, timeout=BLUE_GREEN_READY_TIMEOUT):
+        """
+        Poll status of candidate by its temporary name until it replies.
+        Only candidate serves that name, live instance does not answer it
+        """
+        deadline = time() + timeout
+        while True:
+            status = await rpc.request(name, REQUEST_STATUS)
+            if status:
+                return dict(status)
+            if time() > deadline:
+                raise TimeoutError(f'{name} new instance not ready in {timeout}s')
+            await asyncio.sleep(BLUE_GREEN_POLL)
+
+    async def build_services(self, names):
+        """
+        Build and run services in background, returns BuildJob
+        """
+        return await self.builds.submit(names)
+
+    def image_base(self, name):
+        img = image_navigator[name]
+        if img:
+            buildargs = dock.image_params.get('buildargs') or {}
+            return dockerfile_base(img.path, buildargs=buildargs)
+
     async def remove_service(self, name, no_wait=False):
         svc = await self.get(name)
         await band_config.set_rm(STARTED_SET, name)
         svc.set_status_override(STATUS_REMOVING)
-        coro = self._do_remove_service(name)
-        await (scheduler.spawn(coro) if no_wait else coro)
+        await self.enqueue(name, OP_REMOVE, self._do_remove_service, no_wait)
         return svc
 
     async def _do_remove_service(self, name):
@@ -218,8 +303,7 @@ class StateManager:
         svc = await self.get(name)
         await band_config.set_rm(STARTED_SET, name)
         svc.set_status_override(STATUS_STOPPING)
-        coro = self._do_stop_service(name)
-        await (scheduler.spawn(coro) if no_wait else coro)
+        await self.enqueue(name, OP_STOP, self._do_stop_service, no_wait)
         return svc
 
     async def _do_stop_service(self, name):
@@ -232,8 +316,7 @@ class StateManager:
         if svc.native:
             await band_config.set_add(STARTED_SET, name)
         svc.set_status_override(STATUS_STARTING)
-        coro = self._do_start_service(name)
-        await (scheduler.spawn(coro) if no_wait else coro)
+        await self.enqueue(name, OP_START, self._do_start_service, no_wait)
         return svc
 
     async def _do_start_service(self, name):
@@ -244,12 +327,11 @@ class StateManager:
     async def restart_service(self, name, no_wait=False):
         svc = await self.get(name)
         svc.set_status_override(STATUS_RESTARTING)
-        coro = self._do_restart_service(name)
-        await (scheduler.spawn(coro) if no_wait else coro)
+        await self.enqueue(name, OP_RESTART, self._do_restart_service, no_wait)
         return svc
 
     async def _do_restart_service(self, name):
-        container = await dock.get(name)
+        container = await dock.find(name)
         svc = await self.get(name)
         if container:
             svc.clean_status()
@@ -277,13 +359,29 @@ class StateManager:
 
     async def resolve_docstatus(self, name):
         svc = await self.get(name)
-        container = await dock.get(name)
+        container = dock.cached_get(name) or await dock.get(name)
         if container:
             svc.set_dockstate(container.full_state())
 
     async def resolve_docstatus_all(self):
-        for container in await dock.containers():
-            await self.resolve_docstatus(container.name)
+        """
+        Refresh services docker state from containers cache
+        """
+        for container in dock.cached():
+            # blue/green deploy containers are not services
+            if is_transient(container.name):
+                continue
+            svc = await self.get(container.name)
+            svc.set_dockstate(container.full_state())
+
+    def service_stat(self, name):
+        """
+        Latest container metrics of service
+        """
+        metrics = dock.service_metrics(name)
+        if metrics:
+            return metrics.summary()
+        return dict(sla=0, mem=0, cpu=0)
 
     async def clean_status(self, name):
         (await self.get(name)).clean_status()
@@ -294,28 +392,55 @@ class StateManager:
         payload = dict()
         # Payload for frontend servoce
         if name == FRONTIER_SERVICE:
-            payload.update(self.registrations())
-            payload.update(dict(state_hash=self.registrations_hash))
+            payload.update(self.registrations_payload())
 
         # Loading state, config, meta
         status = await rpc.request(name, REQUEST_STATUS, **payload)
         if status:
             svc.set_appstate(dict(status))
+            if name == FRONTIER_SERVICE:
+                # diffs only after frontier echoed version it holds, full set otherwise
+                echoed = status.get('regs_version')
+                self.frontier_regs_version = echoed if isinstance(echoed, int) else None
+        return status
+
+    def health_targets(self):
+        """
+        Names of running native services to poll
+        """
+        return [c.name for c in dock.cached(status=STATUS_RUNNING)
+                if c.native and not is_transient(c.name)]
 
     async def check_regs_changed(self):
-        new_hash = hash(str(self.registrations()))
+        # activity expires with time, not only on state updates
+        for svc in self.values():
+            svc.sync_registrations()
         # If registrations changed front shold know about that
-        if new_hash != self.registrations_hash:
-            self.registrations_hash = new_hash
+        if self.regs.version != self.frontier_regs_version:
             await self.request_app_state(FRONTIER_SERVICE)
 
+    def registrations_payload(self):
+        """
+        Registrations changes since version frontier confirmed,
+        full set until frontier echoes regs_version
+        """
+        version = self.regs.version
+        diff = self.regs.diff(self.frontier_regs_version)
+        if diff is None:
+            return dict(register=self.regs.methods(), regs_version=version, state_hash=version)
+        added, removed = diff
+        return dict(register_add=added, register_remove=removed,
+                    regs_base=self.frontier_regs_version, regs_version=version,
+                    state_hash=version)
+
+    def reset_frontier_regs(self):
+        """
+        Frontier restarted, next update carries full registrations set
+        """
+        self.frontier_regs_version = None
+
     def registrations(self):
-        methods = []
-        for svc in self.values():
-            if svc.is_active():
-                for method in svc.methods:
-                    methods.append(method)
-        return dict(register=methods)
+        return dict(register=self.regs.methods(), version=self.regs.version)
 
     def clean_ctx(self, name, coro):
         return StateCtx(self, name, coro)
@@ -327,15 +452,27 @@ class StateManager:
     async def configs(self):
         return await band_config.configs_list()
 
+    async def cached_config(self, name):
+        """
+        Config from startup snapshot, redis request when snapshot not loaded yet
+        """
+        if self._configs is not None:
+            return self._configs.get(name)
+        return await self.load_config(name)
+
     async def load_config(self, name):
         config = await band_config.load_config(name)
         if name == SHARED_CONFIG_KEY and config:
             self._shared_config = config
+        if self._configs is not None:
+            self._configs[name] = config
         logger.debug('loaded config', name=name, config=config)
         return config
 
     def save_config(self, name, config):
         logger.info('saving', name=name, config=config)
+        if self._configs is not None:
+            self._configs[name] = config
         job = scheduler.spawn(band_config.save_config(name, config))
         asyncio.ensure_future(job)
 
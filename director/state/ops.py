@@ -0,0 +1,128 @@
+import asyncio
+from collections import deque
+
+from band import logger, scheduler
+
+from ..constants import OP_RUN, OP_STOP, OP_REMOVE
+
+# operations making running or queued build pointless
+SUPERSEDES_RUN = {OP_RUN, OP_STOP, OP_REMOVE}
+
+
+class OperationCancelled(Exception):
+    pass
+
+
+def _consume(future):
+    # errors already logged by worker, no_wait callers never await future
+    if not future.cancelled():
+        future.exception()
+
+
+class Operation:
+    __slots__ = ('kind', 'factory', 'future', 'task', 'reason')
+
+    def __init__(self, kind, factory):
+        self.kind = kind
+        self.factory = factory
+        self.future = asyncio.get_event_loop().create_future()
+        self.future.add_done_callback(_consume)
+        self.task = None
+        self.reason = None
+
+    def cancel(self, reason):
+        self.reason = reason
+        if self.task:
+            self.task.cancel()
+        elif not self.future.done():
+            self.future.set_exception(OperationCancelled(reason))
+
+
+class ServiceOps:
+    """
+    Operations of single service, executed one by one
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.queue = deque()
+        self.current = None
+        self.worker = None
+
+    def pending(self):
+        return [op.kind for op in self.queue]
+
+
+class OperationsQueue:
+    """
+    Per-service serialized operations.
+    Last queued operation of the same kind coalesced with new request,
+    run/stop/remove cancel running or queued build of service.
+    Different services processed in parallel
+    """
+
+    def __init__(self):
+        self._services = dict()
+
+    def submit(self, name, kind, factory):
+        """
+        Queue operation, returns future resolved with operation result
+        """
+        svc = self._services.get(name)
+        if not svc:
+            svc = self._services[name] = ServiceOps(name)
+        # only tail is merged, otherwise requests order would change
+        if svc.queue and svc.queue[-1].kind == kind:
+            logger.debug('operation coalesced', name=name, kind=kind)
+            return svc.queue[-1].future
+        if kind in SUPERSEDES_RUN:
+            reason = f'superseded by {kind}'
+            for op in [op for op in svc.queue if op.kind == OP_RUN]:
+                svc.queue.remove(op)
+                op.cancel(reason)
+            if svc.current and svc.current.kind == OP_RUN:
+                logger.info('cancelling running build', name=name, by=kind)
+                svc.current.cancel(reason)
+        op = Operation(kind, factory)
+        svc.queue.append(op)
+        if not svc.worker:
+            # worker is band job, closed with scheduler on shutdown
+            svc.worker = asyncio.ensure_future(scheduler.spawn(self._worker(svc)))
+        return op.future
+
+    async def _worker(self, svc):
+        try:
+            while svc.queue:
+                op = svc.current = svc.queue.popleft()
+                op.task = asyncio.ensure_future(op.factory())
+                await asyncio.wait((op.task,))
+                if op.future.done():
+                    continue
+                if op.task.cancelled():
+                    op.future.set_exception(OperationCancelled(op.reason or 'cancelled'))
+                elif op.task.exception():
+                    exc = op.task.exception()
+                    logger.error('service operation failed', name=svc.name, kind=op.kind,
+                                 error=str(exc), error_type=type(exc).__name__)
+                    op.future.set_exception(exc)
+                else:
+                    op.future.set_result(op.task.result())
+        except asyncio.CancelledError:
+            # operations do not outlive worker job
+            for op in [svc.current, *svc.queue]:
+                if op and op.task:
+                    op.task.cancel()
+                if op and not op.future.done():
+                    op.future.set_exception(OperationCancelled('shutdown'))
+            svc.queue.clear()
+            raise
+        finally:
+            svc.current = None
+            svc.worker = None
+            if not svc.queue:
+                self._services.pop(svc.name, None)
+
+    def stats(self):
+        return {name: dict(current=svc.current.kind if svc.current else None,
+                           pending=svc.pending())
+                for name, svc in self._services.items()}
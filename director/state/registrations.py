@@ -0,0 +1,86 @@
+from collections import deque
+
+from ..constants import REGS_JOURNAL_SIZE
+
+
+def method_key(method):
+    return (method.get('service'), method.get('method'), method.get('role'))
+
+
+def key_dict(key):
+    service, method, role = key
+    return dict(service=service, method=method, role=role)
+
+
+class RegistrationsIndex:
+    """
+    RPC methods of active services.
+    Every change increments version, recent changes kept in journal
+    to send consumers only difference with version they already have
+    """
+
+    def __init__(self, journal_size=REGS_JOURNAL_SIZE):
+        self.version = 0
+        # published methods: key -> registration
+        self._published = dict()
+        # service -> published methods of service
+        self._by_service = dict()
+        # service -> (methods list, active) last applied
+        self._services = dict()
+        # (version, added registrations, removed keys)
+        self._journal = deque(maxlen=journal_size)
+
+    def update(self, service, methods, active):
+        """
+        Apply service methods and activity. No-op when nothing changed
+        """
+        prev = self._services.get(service)
+        if prev and prev[0] is methods and prev[1] == active:
+            return
+        self._services[service] = (methods, active)
+        old = self._by_service.pop(service, {})
+        new = {method_key(m): m for m in methods} if active else {}
+        if new:
+            self._by_service[service] = new
+        added = [m for k, m in new.items() if old.get(k) != m]
+        removed = [k for k in old if k not in new]
+        if not added and not removed:
+            return
+        for k in removed:
+            del self._published[k]
+        for m in added:
+            self._published[method_key(m)] = m
+        self.version += 1
+        self._journal.append((self.version, added, removed))
+
+    def forget(self, service):
+        self.update(service, (), False)
+        self._services.pop(service, None)
+
+    def methods(self):
+        return list(self._published.values())
+
+    def diff(self, since):
+        """
+        Changes made after version `since` as (added, removed).
+        None when journal does not cover it and full set should be sent
+        """
+        if since is None or since > self.version:
+            return None
+        if since == self.version:
+            return [], []
+        if not self._journal or self._journal[0][0] > since + 1:
+            return None
+        added = dict()
+        removed = set()
+        for version, add, rm in self._journal:
+            if version <= since:
+                continue
+            for k in rm:
+                added.pop(k, None)
+                removed.add(k)
+            for m in add:
+                k = method_key(m)
+                removed.discard(k)
+                added[k] = m
+        return list(added.values()), [key_dict(k) for k in removed]
@@ -1,8 +1,6 @@
 from prodict import Prodict as pdict
 from typing import List, Dict
 from time import time
-from random import randint
-from collections import deque
 from ..constants import SERVICE_TIMEOUT, STATUS_RUNNING, STATUS_STARTING, STATUS_REMOVING
 from ..helpers import nn, isn, req_to_bool
 from band import logger, app
@@ -48,7 +46,6 @@ class ServiceState(pdict):
         self._manager = manager
         self._build_options = pdict()
         self._env = pdict()
-        self._logs = deque(maxlen=1000)
         self._name = name
         self._title = name.replace('_', ' ').title()
         self.clean_status()
@@ -66,6 +63,7 @@ class ServiceState(pdict):
         self._protected = False
         self._persistent = False
         self._native = False
+        self.sync_registrations()
 
     @property
     def config(self):
@@ -89,6 +87,8 @@ class ServiceState(pdict):
             state = STATUS_RUNNING
             uptime = appdata.app_uptime
 
+        stat = self._manager.service_stat(self.name)
+
         return pdict(
             name=self.name,
             uptime=uptime,
@@ -97,14 +97,10 @@ class ServiceState(pdict):
             inband=inband,
             pos=self.pos,
             # TODO: remove when dashboard updated
-            sla=randint(98, 99),
-            mem=randint(1, 3),
-            cpu=randint(1, 3),
-            stat=dict(
-                sla=0,
-                mem=0,
-                cpu=0,
-            ),
+            sla=stat['sla'],
+            mem=stat['mem'],
+            cpu=stat['cpu'],
+            stat=stat,
             meta=dict(
                 native=self._native,
                 managed=self._managed,
@@ -217,6 +213,7 @@ class ServiceState(pdict):
             rec = method.copy()
             rec.update(service=self.name)
             self._methods.append(rec)
+        self.sync_registrations()
 
     def set_appstate(self, appstate):
         if appstate:
@@ -224,6 +221,7 @@ class ServiceState(pdict):
             self._app_ts = time()
             if 'register' in appstate:
                 self.set_methods(appstate['register'])
+            self.sync_registrations()
 
     @property
     def dockstate(self):
@@ -240,3 +238,10 @@ class ServiceState(pdict):
             
             if dockstate.running == True:
                 self._dock_ts = time()
+            self.sync_registrations()
+
+    def sync_registrations(self):
+        """
+        Publish methods to registrations index while service active
+        """
+        self._manager.regs.update(self.name, self._methods, self.is_active())
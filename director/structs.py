@@ -35,6 +35,7 @@ class ServicePostion(namedtuple('ServicePostion', 'col row')):
 class BuildOptions(Prodict):
     nocache: bool
     auto_remove: bool
+    blue_green: bool
 
 
 class RunParams(Prodict):
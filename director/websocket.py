@@ -6,56 +6,133 @@ from aiohttp import web
 from band import dome, scheduler, logger, worker, rpc
 from . import state
 from concurrent.futures import CancelledError
-import datetime
 from simplech import AsyncClickHouse
 from .structs import LogRecord
+from .log_broker import LogFilter
+from .constants import (
+    LOGS_BATCH_SIZE, LOGS_BATCH_MAX_MS, LOGS_QUEUE_SIZE, LOGS_QUEUE_MAX_SIZE,
+    OVERFLOW_DROP_OLDEST, OVERFLOW_POLICIES)
 
 ch = AsyncClickHouse()
 
 
-async def ws_sender(ws):
-    subscription = state.logs_reader()
+async def ws_sender(ws, subscription):
     while True:
         try:
-            msg = await subscription.get()
-            if msg is None:
+            if subscription.batch_ms:
+                items = await subscription.get_batch(
+                    subscription.batch_size, subscription.batch_ms / 1000)
+            else:
+                item = await subscription.get()
+                items = [item] if item else None
+            if items is None:
+                if subscription.overflowed:
+                    logger.warn('ws client too slow, disconnecting', dropped=subscription.dropped)
+                    await ws.close()
                 break
 
-            tstr = datetime.datetime.utcfromtimestamp(
-                msg.ts / 1000).strftime("%m%d %H:%m:%S.%s")[:18]
-            data = {
-                'id': msg.id,
-                'cid': msg.cid,
-                'cname': msg.name,
-                'time': tstr,
-                'ts': msg.ts,
-                'source': msg.source,
-                'data': msg.message
-            }
-            await ws.send_str(ujson.dumps(data))
-            await rpc.notify('logs', 'write', msg=msg)
+            if subscription.batch_ms:
+                await ws.send_str('[' + ','.join(raw for _, raw in items) + ']')
+            else:
+                await ws.send_str(items[0][1])
         except CancelledError:
             logger.debug('ws writer closed')
             break
         except Exception:
             logger.exception('ex')
             break
+    subscription.close()
+
+
+def batch_params(cmd, maxsize=LOGS_QUEUE_SIZE):
+    """
+    Connection batching params from subscribe command
+    """
+    batch_ms = int(cmd.get('batch_ms') or 0)
+    batch_size = int(cmd.get('batch_size') or min(LOGS_BATCH_SIZE, maxsize))
+    if not 0 <= batch_ms <= LOGS_BATCH_MAX_MS:
+        raise ValueError(f'batch_ms should be in range 0..{LOGS_BATCH_MAX_MS}')
+    if not 0 < batch_size <= maxsize:
+        raise ValueError(f'batch_size should be in range 1..{maxsize}')
+    return batch_ms, batch_size
+
+
+def queue_params(cmd):
+    """
+    Subscriber queue size and overflow policy from subscribe command
+    """
+    maxsize = int(cmd.get('maxsize') or LOGS_QUEUE_SIZE)
+    policy = cmd.get('policy') or OVERFLOW_DROP_OLDEST
+    if not 0 < maxsize <= LOGS_QUEUE_MAX_SIZE:
+        raise ValueError(f'maxsize should be in range 1..{LOGS_QUEUE_MAX_SIZE}')
+    if policy not in OVERFLOW_POLICIES:
+        raise ValueError(f"policy should be one of {', '.join(OVERFLOW_POLICIES)}")
+    return maxsize, policy
+
+
+def resubscribe(subscription, maxsize, policy):
+    """
+    New subscription with given queue params, not yet sent records carried over
+    """
+    fresh = state.logs_reader(maxsize=maxsize, policy=policy)
+    fresh.queue.extend(list(subscription.queue)[-maxsize:])
+    subscription.close()
+    return fresh
+
+
+async def ws_command(ws, subscription, data):
+    """
+    Client commands handler, returns subscription to use further.
+    {"type": "subscribe", "names": [], "ids": [], "sources": [], "since_id": 0, "since_ts": 0,
+     "grep": "", "regex": false, "batch_ms": 0, "batch_size": 200, "replay": 0,
+     "maxsize": 1000, "policy": "drop_oldest"}
+    selects log records to receive, empty subscription means all records.
+    With batch_ms > 0 records are sent as json array every batch_ms or batch_size records.
+    With replay > 0 or since_id set matching history records are sent before live ones.
+    maxsize and policy set queue size and overflow behaviour:
+    drop_oldest, drop_newest or disconnect
+    """
+    try:
+        cmd = ujson.loads(data)
+        if not isinstance(cmd, dict):
+            raise ValueError('command should be an object')
+        if cmd.get('type') == 'subscribe':
+            log_filter = LogFilter.from_request(cmd)
+            maxsize, policy = queue_params(cmd)
+            batch = batch_params(cmd, maxsize)
+            if (maxsize, policy) != (subscription.maxsize, subscription.policy):
+                subscription = resubscribe(subscription, maxsize, policy)
+            subscription.batch_ms, subscription.batch_size = batch
+            replay = int(cmd.get('replay') or 0)
+            subscription.set_filter(log_filter)
+            if replay or log_filter.since_id is not None:
+                subscription.replay(state.logs_history(log_filter, last=replay or None))
+        else:
+            raise ValueError(f"unknown command {cmd.get('type')}")
+    except (ValueError, TypeError) as exc:
+        await ws.send_str(ujson.dumps({'type': 'error', 'error': str(exc)}))
+    return subscription
 
 
 async def websocket_handler(request):
     ws = web.WebSocketResponse()
+    subscription = state.logs_reader()
+    sender = None
 
     try:
         await ws.prepare(request)
-        sender = await scheduler.spawn(ws_sender(ws))
+        sender = await scheduler.spawn(ws_sender(ws, subscription))
         async for msg in ws:
             if msg.type == aiohttp.WSMsgType.TEXT:
                 if msg.data == 'close':
                     await ws.close()
                 else:
-                    # MSG handler
-                    pass
-                    # await ws.send_str(msg.data + '/answer')
+                    current = await ws_command(ws, subscription, msg.data)
+                    if current is not subscription:
+                        # previous sender flushes what it took and stops on closed subscription
+                        await sender.wait()
+                        subscription = current
+                        sender = await scheduler.spawn(ws_sender(ws, subscription))
             elif msg.type == aiohttp.WSMsgType.ERROR:
                 print(
                     'ws connection closed with exception %s' % ws.exception())
@@ -67,7 +144,9 @@ async def websocket_handler(request):
     except Exception:
         logger.exception('ex')
     finally:
-        await sender.close()
+        subscription.close()
+        if sender:
+            await sender.close()
 
     return ws
 